@@ -2,10 +2,18 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from flask_jwt_extended import JWTManager
 from flask_socketio import SocketIO  # Add this import
+from dogpile.cache import make_region
+from flask_limiter import Limiter
+from flask_limiter.util import get_remote_address
 
 # Initialize extensions
-db = SQLAlchemy()
+# Sessions are request-scoped, so objects needn't be reloaded after each commit;
+# handlers that echo fields back after commit() skip a SELECT per object
+db = SQLAlchemy(session_options={"expire_on_commit": False})
 migrate = Migrate()
 jwt = JWTManager()
-socketio = SocketIO(async_mode='threading')  # Use threading mode, which works without additional dependencies
-
+socketio = SocketIO(async_mode='gevent')  # Green threads; main.py monkey-patches the stdlib before import
+# Shared query-result cache; the backend (memory or Redis) is configured in create_app
+cache_region = make_region()
+# Request rate limits; storage (memory or Redis) is configured in create_app
+limiter = Limiter(key_func=get_remote_address)
@@ -1,38 +1,134 @@
-from flask_bcrypt import Bcrypt
-from flask import Blueprint
-from datetime import datetime, timedelta
-from app import db
+import bcrypt
+import hashlib
+from flask import Blueprint, current_app
+from datetime import date, datetime, timedelta
+from enum import IntEnum
+from sqlalchemy import event, SmallInteger
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.sql import func
+from sqlalchemy.types import TypeDecorator
+from sqlalchemy.exc import IntegrityError
+from app import db, cache_region
 
 auth_bp = Blueprint("auth", __name__)
-bcrypt = Bcrypt()
+
+
+class LabeledIntEnum(IntEnum):
+    """Integer-backed enum whose members are exposed as lower-case string labels."""
+
+    @property
+    def label(self):
+        return self.name.lower().replace("_", " ")
+
+    @classmethod
+    def from_label(cls, label):
+        try:
+            return cls[label.upper().replace(" ", "_")]
+        except KeyError:
+            raise ValueError(f"Invalid {cls.__name__} value: {label!r}")
+
+
+class IntEnumType(TypeDecorator):
+    """Stores a LabeledIntEnum as SMALLINT while the ORM keeps using string labels."""
+
+    impl = SmallInteger
+    cache_ok = True
+
+    def __init__(self, enum_cls, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.enum_cls = enum_cls
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        if isinstance(value, str):
+            value = self.enum_cls.from_label(value)
+        return int(value)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return self.enum_cls(value).label
+
+
+class UserStatus(LabeledIntEnum):
+    ACTIVE = 0
+    INACTIVE = 1
+
+
+class VMStatus(LabeledIntEnum):
+    RUNNING = 0
+    STOPPED = 1
+
+
+class VMType(LabeledIntEnum):
+    LINUX = 0
+    WINDOWS = 1
+
+
+class ProjectStatus(LabeledIntEnum):
+    NOT_STARTED = 0
+    IN_PROGRESS = 1
+    COMPLETE = 2
+
+
+class TargetStatus(LabeledIntEnum):
+    NOT_TESTED = 0
+    IN_PROGRESS = 1
+    TESTED = 2
 
 
 class User(db.Model):
     __tablename__ = "users"
+    # Identity lookups read just these columns by employee_id; on PostgreSQL
+    # the INCLUDE list makes them index-only. Elsewhere INCLUDE is dropped and
+    # it would only duplicate the primary key, so it is created there alone
+    __table_args__ = (
+        db.Index(
+            "ix_users_emp_cov",
+            "employee_id",
+            postgresql_include=["role", "name", "status"],
+        ).ddl_if(dialect="postgresql"),
+        # Tester/manager listings filter by role and show these columns
+        db.Index(
+            "ix_users_role",
+            "role",
+            postgresql_include=["employee_id", "name", "email"],
+        ),
+    )
 
     employee_id = db.Column(db.String(20), primary_key=True, unique=True)
     name = db.Column(db.String(100), nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
     password_hash = db.Column(db.String(255), nullable=False)
     role = db.Column(db.String(50), nullable=False, default="tester")
-    status = db.Column(
-        db.Enum("active", "inactive", name="user_status"),
-        nullable=False,
-        default="active",
-    )
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    status = db.Column(IntEnumType(UserStatus), nullable=False, default="active")
+    created_at = db.Column(db.DateTime, server_default=func.now(), nullable=False)
     updated_at = db.Column(
-        db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow
+        db.DateTime, server_default=func.now(), onupdate=func.now(), nullable=False
     )
     profile_picture = db.Column(db.String(255), nullable=True)
 
     def set_password(self, password: str):
         """Hashes and sets the password."""
-        self.password_hash = bcrypt.generate_password_hash(password).decode("utf-8")
+        salt = bcrypt.gensalt(rounds=current_app.config["BCRYPT_LOG_ROUNDS"])
+        self.password_hash = bcrypt.hashpw(password.encode("utf-8"), salt).decode(
+            "utf-8"
+        )
 
     def check_password(self, password):
-        """Checks if the provided password matches the stored hash."""
-        return bcrypt.check_password_hash(self.password_hash, password)
+        """Checks if the provided password matches the stored hash.
+
+        A matching hash made with a different cost than BCRYPT_LOG_ROUNDS is
+        replaced, so the caller should commit if the user was modified.
+        """
+        # The cost factor is read back from the stored hash ("$2b$12$...")
+        stored = self.password_hash.encode("utf-8")
+        if not bcrypt.checkpw(password.encode("utf-8"), stored):
+            return False
+        if int(stored[4:6]) != current_app.config["BCRYPT_LOG_ROUNDS"]:
+            self.set_password(password)
+        return True
 
     def change_role(self, new_role):
         """Changes the user's role."""
@@ -43,10 +139,16 @@ class User(db.Model):
         self.role = new_role
 
     def change_email(self, new_email):
-        """Changes the user's email."""
-        if User.query.filter_by(email=new_email).first():
+        """Changes the user's email, relying on the unique index to reject duplicates.
+
+        The change is flushed in a savepoint, so a duplicate undoes only the
+        email and leaves the caller's other pending changes in the session.
+        """
+        try:
+            with db.session.begin_nested():
+                self.email = new_email
+        except IntegrityError:
             raise ValueError("Email already in use.")
-        self.email = new_email
 
     def change_status(self, new_status):
         """Changes the user's status."""
@@ -58,124 +160,272 @@ class User(db.Model):
         return f"<User {self.employee_id}>"
 
 
+def user_cache_key(employee_id):
+    """Cache key of the identity snapshot stored for a user."""
+    return f"user:{employee_id}"
+
+
+# Cache key of the serialized admin user listing
+USER_LIST_CACHE_KEY = "users:list"
+
+
+def role_list_cache_key(role):
+    """Cache key of the tester/manager listing for a role."""
+    return f"users:role:{role}"
+
+
+# Every cached listing that a change to any user row can affect
+_USER_LISTING_KEYS = [USER_LIST_CACHE_KEY] + [
+    role_list_cache_key(role) for role in ("tester", "manager")
+]
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_cached_user(mapper, connection, target):
+    # Role, email, status and name changes all go through an UPDATE on users
+    cache_region.delete(user_cache_key(target.employee_id))
+    cache_region.delete_multi(_USER_LISTING_KEYS)
+
+
+@event.listens_for(User, "after_insert")
+def _invalidate_user_list(mapper, connection, target):
+    cache_region.delete_multi(_USER_LISTING_KEYS)
+
+
 def init_extensions(app):
-    bcrypt.init_app(app)
     db.init_app(app)
 
 
+# How long a password reset link stays valid
+RESET_TOKEN_LIFETIME = timedelta(minutes=15)
+
+
+def hash_reset_token(reset_token):
+    return hashlib.sha256(reset_token).digest()
+
+
 class PasswordReset(db.Model):
     __tablename__ = "password_resets"
+    __table_args__ = (db.Index("ix_pwreset_expiry", "expires_at"),)
 
     id = db.Column(db.Integer, primary_key=True)
+    # One live token per user; a new request replaces the old row in place
     employee_id = db.Column(
-        db.String(20), db.ForeignKey("users.employee_id"), nullable=False
+        db.String(20), db.ForeignKey("users.employee_id"), nullable=False, unique=True
     )
-    reset_token = db.Column(db.String(64), unique=True, nullable=False)
+    # SHA-256 of the 32-byte token; the token itself only ever appears in the
+    # reset link, so a leaked table or log can't be replayed
+    reset_token_hash = db.Column(db.LargeBinary(32), unique=True, nullable=False)
     expires_at = db.Column(
         db.DateTime,
         nullable=False,
-        default=lambda: datetime.utcnow() + timedelta(minutes=15),
+        default=lambda: datetime.utcnow() + RESET_TOKEN_LIFETIME,
     )
 
     def is_expired(self):
         return datetime.utcnow() > self.expires_at
 
+    @classmethod
+    def issue(cls, employee_id, reset_token):
+        """Stores reset_token as the user's only token, replacing any earlier one."""
+        values = {
+            "employee_id": employee_id,
+            "reset_token_hash": hash_reset_token(reset_token),
+            "expires_at": datetime.utcnow() + RESET_TOKEN_LIFETIME,
+        }
+        upsert_insert = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}.get(
+            db.session.get_bind().dialect.name
+        )
+        if upsert_insert:
+            # One INSERT ... ON CONFLICT DO UPDATE instead of DELETE + INSERT
+            insert = upsert_insert(cls).values(**values)
+            db.session.execute(
+                insert.on_conflict_do_update(
+                    index_elements=[cls.employee_id],
+                    set_={
+                        "reset_token_hash": insert.excluded.reset_token_hash,
+                        "expires_at": insert.excluded.expires_at,
+                    },
+                )
+            )
+        else:
+            db.session.execute(db.delete(cls).where(cls.employee_id == employee_id))
+            db.session.execute(db.insert(cls).values(**values))
+        db.session.commit()
+
+    @classmethod
+    def find_by_token(cls, reset_token):
+        """Looks up the reset row for a token via the unique hash index."""
+        return cls.query.filter_by(
+            reset_token_hash=hash_reset_token(reset_token)
+        ).first()
+
+    @classmethod
+    def purge_expired(cls):
+        """Delete expired reset tokens in one statement; returns the row count."""
+        result = db.session.execute(
+            db.delete(cls).where(cls.expires_at < datetime.utcnow())
+        )
+        db.session.commit()
+        return result.rowcount
+
 
 class vms(db.Model):
     __tablename__ = "vms"
+    # VM actions look up "user X's linux/windows VM"; also serves employee_id alone
+    __table_args__ = (db.Index("ix_vms_emp_os", "employee_id", "instance_os"),)
 
     id = db.Column(db.Integer, primary_key=True)
     instance_id = db.Column(db.String(255), nullable=False)
     guacamole_url = db.Column(db.String(255), nullable=True)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, server_default=func.now(), nullable=False)
     updated_at = db.Column(
-        db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow
+        db.DateTime, server_default=func.now(), onupdate=func.now(), nullable=False
     )
     employee_id = db.Column(
         db.String(20), db.ForeignKey("users.employee_id"), nullable=False
     )
-    status = db.Column(
-        db.Enum("running", "stopped", name="vm_status"),
-        nullable=False,
-        default="stopped",
-    )
-    instance_os = db.Column(db.Enum("linux", "windows", name="vm_type"), nullable=False)
+    status = db.Column(IntEnumType(VMStatus), nullable=False, default="stopped")
+    instance_os = db.Column(IntEnumType(VMType), nullable=False)
+    # A VPC instance keeps its primary private IP across stop/start, so it is
+    # looked up once and reused for the Guacamole connection
+    private_ip = db.Column(db.String(45), nullable=True)
+
+    # Loaded on demand; listings should use selectinload(vms.user)
+    user = db.relationship("User", backref=db.backref("vms", lazy="dynamic"))
 
 
 class projects(db.Model):
     __tablename__ = "projects"
+    # "My projects" filters on manager and skips archived rows; on PostgreSQL
+    # the INCLUDE columns let that lookup skip the heap. It also serves plain
+    # manager lookups, so manager needs no index of its own
+    __table_args__ = (
+        db.Index(
+            "ix_projects_manager_archived",
+            "manager",
+            "archived",
+            postgresql_include=["name", "status", "start_date", "end_date"],
+        ),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(30), nullable=False)
     description = db.Column(db.Text, nullable=False)
     scope = db.Column(db.Text, nullable=False)
     status = db.Column(
-        db.Enum("not started", "in progress", "complete", name="project_status"),
-        nullable=False,
-        default="not started",
+        IntEnumType(ProjectStatus), nullable=False, default="not started", index=True
     )
-    start_date = db.Column(db.DateTime, default=datetime.utcnow)
-    end_date = db.Column(db.DateTime, nullable=True)
+    # Calendar dates only; the JSON provider renders them as YYYY-MM-DD
+    start_date = db.Column(db.Date, default=date.today)
+    end_date = db.Column(db.Date, nullable=True)
 
     manager = db.Column(
         db.String(20), db.ForeignKey("users.employee_id"), nullable=False
     )
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, server_default=func.now(), nullable=False)
     updated_at = db.Column(
-        db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow
+        db.DateTime, server_default=func.now(), onupdate=func.now(), nullable=False
     )
     updated_by = db.Column(
-        db.String(20), db.ForeignKey("users.employee_id"), nullable=False
+        db.String(20), db.ForeignKey("users.employee_id"), nullable=False, index=True
     )
     archived = db.Column(db.Boolean, default=False)
 
+    # lazy="raise" makes an un-eager-loaded access fail loudly instead of
+    # silently issuing one query per row; use selectinload/joinedload
+    manager_user = db.relationship("User", foreign_keys=[manager], lazy="raise")
+    members = db.relationship("assignments", viewonly=True, lazy="raise")
+
 
 class assignments(db.Model):
     __tablename__ = "assignments"
+    # One row per (project, member); with project_id leading, the constraint's
+    # index also serves "members of project X", and employee_id keeps its own
+    __table_args__ = (
+        db.UniqueConstraint("project_id", "employee_id", name="uq_assign_proj_emp"),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     employee_id = db.Column(
-        db.String(20), db.ForeignKey("users.employee_id"), nullable=False
+        db.String(20), db.ForeignKey("users.employee_id"), nullable=False, index=True
     )
     project_id = db.Column(db.Integer, db.ForeignKey("projects.id"), nullable=False)
-    assigned_at = db.Column(db.DateTime, default=datetime.utcnow)
+    assigned_at = db.Column(db.DateTime, server_default=func.now(), nullable=False)
+
+    user = db.relationship("User", lazy="raise")
 
 
 class targets(db.Model):
     __tablename__ = "targets"
+    __table_args__ = (db.Index("ix_target_proj_status", "project_id", "status"),)
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(255), nullable=False)
     description = db.Column(db.Text, nullable=True)
-    project_id = db.Column(db.Integer, db.ForeignKey("projects.id"), nullable=False)
-    status = db.Column(
-        db.Enum("not tested", "in progress", "tested", name="target_status"),
-        nullable=False,
-        default="not tested",
+    project_id = db.Column(
+        db.Integer, db.ForeignKey("projects.id"), nullable=False, index=True
     )
-    tester = db.Column(db.String(20), db.ForeignKey("users.employee_id"), nullable=True)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    status = db.Column(IntEnumType(TargetStatus), nullable=False, default="not tested")
+    tester = db.Column(
+        db.String(20), db.ForeignKey("users.employee_id"), nullable=True, index=True
+    )
+    created_at = db.Column(db.DateTime, server_default=func.now(), nullable=False)
     updated_at = db.Column(
-        db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow
+        db.DateTime, server_default=func.now(), onupdate=func.now(), nullable=False
     )
     updated_by = db.Column(
-        db.String(20), db.ForeignKey("users.employee_id"), nullable=True
+        db.String(20), db.ForeignKey("users.employee_id"), nullable=True, index=True
     )
 
 
 class ChatMessage(db.Model):
     __tablename__ = "chat_messages"
+    # Timeline reads are "latest messages in project X", paged by the
+    # (timestamp, id) cursor; on PostgreSQL the INCLUDE columns let the
+    # listing run as an index-only scan
+    __table_args__ = (
+        db.Index(
+            "ix_chat_proj_ts_cov",
+            "project_id",
+            db.text("timestamp DESC"),
+            db.text("id DESC"),
+            postgresql_include=["employee_id", "is_file"],
+        ),
+    )
 
-    id = db.Column(db.Integer, primary_key=True)
-    project_id = db.Column(db.Integer, db.ForeignKey("projects.id"), nullable=False)
+    # SQLite only auto-increments INTEGER PRIMARY KEY, so keep that type there
+    id = db.Column(
+        db.BigInteger().with_variant(db.Integer, "sqlite"), primary_key=True
+    )
+    project_id = db.Column(
+        db.Integer, db.ForeignKey("projects.id"), nullable=False, index=True
+    )
     employee_id = db.Column(
-        db.String(20), db.ForeignKey("users.employee_id"), nullable=False
+        db.String(20), db.ForeignKey("users.employee_id"), nullable=False, index=True
     )
     content = db.Column(db.Text, nullable=False)
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    # Stored with its UTC offset so clients don't read it as local time
+    timestamp = db.Column(
+        db.DateTime(timezone=True), server_default=func.now(), nullable=False
+    )
     is_file = db.Column(db.Boolean, default=False)
     file_path = db.Column(db.String(255), nullable=True)
-
-    # Relationships
-    sender = db.relationship("User", backref="sent_messages")
-    project = db.relationship("projects", backref="chat_messages")
+    # Set while an attachment is still being copied to object storage
+    upload_pending = db.Column(
+        db.Boolean, nullable=False, default=False, server_default=db.false()
+    )
+    # Name the file was uploaded with; on disk it is stored under a random name
+    original_filename = db.Column(db.String(255), nullable=True)
+
+    # Relationships: the sender is needed for every rendered message, so join it
+    # in; the project is usually already known, so it stays lazy and queries
+    # that want it add selectinload(ChatMessage.project). Backrefs are dynamic
+    # so user.sent_messages / project.chat_messages stay queries
+    sender = db.relationship(
+        "User", backref=db.backref("sent_messages", lazy="dynamic"), lazy="joined"
+    )
+    project = db.relationship(
+        "projects", backref=db.backref("chat_messages", lazy="dynamic")
+    )
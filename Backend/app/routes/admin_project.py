@@ -1,29 +1,89 @@
 from flask import Blueprint, request, jsonify
 from werkzeug.utils import secure_filename
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from app.models import User, projects, assignments
+from app.models import User, projects, assignments, ProjectStatus
 from flasgger import swag_from
-from app.utils.auth_utils import roles_required
+from app.utils.auth_utils import roles_required, invalidate_project_access
+from app.utils.json_utils import conditional_json
 from app.utils.vm_utils import (
     start_vm_util,
     stop_vm_util,
     vm_status_util,
     restart_vm_util,
 )
-from datetime import datetime
+from pydantic import ValidationError
+from sqlalchemy import case, cast, func, insert, select
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+from sqlalchemy.exc import IntegrityError
 from app import db
+from app.schemas import (
+    AssignmentBody,
+    BulkAssignmentBody,
+    CreateProjectBody,
+    UpdateProjectBody,
+    validation_message,
+)
 
 admin_project_bp = Blueprint("admin blueprint for project management", __name__)
 
 
+@admin_project_bp.errorhandler(ValidationError)
+def handle_invalid_body(error):
+    return jsonify({"message": validation_message(error)}), 400
+
+
+def _all_projects_json():
+    """Builds the whole project list as one JSON array inside PostgreSQL."""
+    status_label = case(
+        {status.value: status.label for status in ProjectStatus}, value=projects.status
+    )
+    fields = {
+        "id": projects.id,
+        "name": projects.name,
+        "description": projects.description,
+        "scope": projects.scope,
+        "status": status_label,
+        "manager": projects.manager,
+        "manager_name": User.name,
+        "archived": projects.archived,
+        "start_date": projects.start_date,
+        "end_date": projects.end_date,
+    }
+    row = func.json_build_object(
+        *(arg for key, column in fields.items() for arg in (db.literal(key), column))
+    )
+    return db.session.execute(
+        db.select(cast(func.json_agg(aggregate_order_by(row, projects.id)), db.Text))
+        .select_from(projects)
+        .outerjoin(User, User.employee_id == projects.manager)
+    ).scalar()
+
+
 @admin_project_bp.route("/get-all-projects", methods=["GET"])
 @roles_required("admin")
 @swag_from(
     {
         "tags": ["Admin Projects"],
         "summary": "Get all projects",
-        "description": "Get all projects.",
+        "description": "Get all projects. Passing limit or after_id switches to "
+        "keyset pagination and returns {items, next_after_id} instead of an array.",
         "security": [{"BearerAuth": []}],
+        "parameters": [
+            {
+                "name": "limit",
+                "in": "query",
+                "type": "integer",
+                "required": False,
+                "description": "Page size (default 100, max 500).",
+            },
+            {
+                "name": "after_id",
+                "in": "query",
+                "type": "integer",
+                "required": False,
+                "description": "Return projects with an id greater than this.",
+            },
+        ],
         "responses": {
             200: {
                 "description": "List of all projects",
@@ -56,32 +116,50 @@ admin_project_bp = Blueprint("admin blueprint for project management", __name__)
     }
 )
 def get_all_projects():
-    projects_list = projects.query.filter_by().all()
-    if not projects_list:
-        return jsonify({"message": "No projects found"}), 404
-
-    project_data = []
-    for project in projects_list:
-        manager_user = User.query.filter_by(employee_id=project.manager).first()
-        manager_name = manager_user.name if manager_user else None
-        project_data.append(
-            {
-                "id": project.id,
-                "name": project.name,
-                "description": project.description,
-                "scope": project.scope,
-                "status": project.status,
-                "manager": project.manager,
-                "manager_name": manager_name,
-                "archived": project.archived,
-                "start_date": project.start_date.strftime("%Y-%m-%d"),
-                "end_date": (
-                    project.end_date.strftime("%Y-%m-%d") if project.end_date else None
-                ),
-            }
+    limit = request.args.get("limit", type=int)
+    after_id = request.args.get("after_id", type=int)
+    paginate = limit is not None or after_id is not None
+
+    if not paginate and db.session.get_bind().dialect.name == "postgresql":
+        # Let PostgreSQL build the JSON so no per-row Python objects are made
+        project_json = _all_projects_json()
+        if project_json is None:
+            return jsonify({"message": "No projects found"}), 404
+        return conditional_json(project_json.encode("utf-8"))
+
+    # Select just the returned columns, with the manager's name joined in,
+    # so no ORM objects are built and unused columns never leave the DB
+    query = (
+        db.session.query(
+            projects.id,
+            projects.name,
+            projects.description,
+            projects.scope,
+            projects.status,
+            projects.manager,
+            User.name.label("manager_name"),
+            projects.archived,
+            projects.start_date,
+            projects.end_date,
         )
+        .outerjoin(User, User.employee_id == projects.manager)
+        .order_by(projects.id)
+    )
+    if paginate:
+        # Keyset pagination: an index range scan on id, however deep the page
+        limit = min(max(limit or 100, 1), 500)
+        query = query.filter(projects.id > (after_id or 0)).limit(limit)
+
+    project_data = [row._asdict() for row in query.all()]
 
-    return jsonify(project_data), 200
+    if paginate:
+        next_after_id = project_data[-1]["id"] if len(project_data) == limit else None
+        return conditional_json(
+            {"items": project_data, "next_after_id": next_after_id}
+        )
+    if not project_data:
+        return jsonify({"message": "No projects found"}), 404
+    return conditional_json(project_data)
 
 
 @admin_project_bp.route("/create-project", methods=["POST"])
@@ -171,52 +249,52 @@ def get_all_projects():
 )
 def create_project():
     current_user_id = get_jwt_identity()
-    user = User.query.filter_by(employee_id=current_user_id).first()
-    if not user:
-        return jsonify({"message": "User not found"}), 404
+    body = CreateProjectBody.model_validate_json(request.get_data())
+
+    # Insert only if the manager exists and is an admin or manager, returning
+    # the new id, so the common path is a single statement
+    eligible_manager = db.select(
+        db.literal(body.project_name, db.String),
+        db.literal(body.description, db.Text),
+        db.literal(body.scope, db.Text),
+        db.literal(body.start_date, db.Date),
+        db.literal(body.end_date, db.Date),
+        User.employee_id,
+        db.literal(current_user_id, db.String),
+    ).where(
+        User.employee_id == body.manager, User.role.in_(["admin", "manager"])
+    )
+    project_id = db.session.execute(
+        insert(projects)
+        .from_select(
+            [
+                "name",
+                "description",
+                "scope",
+                "start_date",
+                "end_date",
+                "manager",
+                "updated_by",
+            ],
+            eligible_manager,
+        )
+        .returning(projects.id)
+    ).scalar()
 
-    data = request.get_json()
-    # Get the form data
-    project_name = data.get("project_name")
-    description = data.get("description")
-    scope = data.get("scope")
-    start_date = data.get("start_date")
-    end_date = data.get("end_date")
-    manager = data.get("manager")
-    # check if manager user id provided is a value user id and has the role of manager or admin
-    manager_user = User.query.filter_by(employee_id=manager).first()
-    if not manager_user:
-        return jsonify({"message": "Manager not found"}), 404
-    if manager_user.role not in ["admin", "manager"]:
+    if project_id is None:
+        # Nothing was inserted; look up the role only to pick the error
+        manager_role = (
+            db.session.query(User.role).filter_by(employee_id=body.manager).scalar()
+        )
+        if not manager_role:
+            return jsonify({"message": "Manager not found"}), 404
         return jsonify({"message": "Manager must be an admin or manager"}), 400
-
-    # Validate the input data (you can add more validation as needed)
-    if not project_name or not description or not start_date or not end_date:
-        return jsonify({"message": "All fields are required"}), 400
-
-    # validate date format (YYYY-MM-DD) and check if start_date is before end_date
-    try:
-        start_date = datetime.strptime(start_date, "%Y-%m-%d").date()
-        end_date = datetime.strptime(end_date, "%Y-%m-%d").date()
-        if start_date >= end_date:
-            return jsonify({"message": "Start date must be before end date"}), 400
-    except ValueError:
-        return jsonify({"message": "Invalid date format. Use YYYY-MM-DD."}), 400
-
-    # Create a new project entry in the database
-    new_project = projects(
-        name=project_name,
-        description=description,
-        scope=scope,
-        start_date=start_date,
-        end_date=end_date,
-        manager=current_user_id,
-        updated_by=current_user_id,
-    )
-    db.session.add(new_project)
     db.session.commit()
 
-    return jsonify({"message": "Project created successfully"}), 201
+    return (
+        jsonify({"message": "Project created successfully", "project_id": project_id}),
+        201,
+    )
 
 
 @admin_project_bp.route("/update-project/<int:project_id>", methods=["PUT"])
@@ -303,64 +381,50 @@ def create_project():
 )
 def update_project(project_id):
     current_user_id = get_jwt_identity()
-    user = User.query.filter_by(employee_id=current_user_id).first()
-    if not user:
-        return jsonify({"message": "User not found"}), 404
+    # Validate the body first, so bad payloads cost no query
+    body = UpdateProjectBody.model_validate_json(request.get_data())
 
     # Get the project to update
-    project = projects.query.get(project_id)
+    project = db.session.get(projects, project_id)
     if not project:
         return jsonify({"message": "Project not found"}), 404
 
-    data = request.get_json()
-    # Get the form data
-    project_name = data.get("project_name")
-    description = data.get("description")
-    scope = data.get("scope")
-    status = data.get("status")
-    start_date = data.get("start_date")
-    end_date = data.get("end_date")
     # check if manager user id provided is a value user id and has the role of manager or admin
-    manager = data.get("manager")
-    print("manager", manager)
-    if manager:
-        manager_user = User.query.filter_by(employee_id=manager).first()
-        print("manager_user", manager_user)
-        if not manager_user:
+    if body.manager:
+        manager_role = (
+            db.session.query(User.role).filter_by(employee_id=body.manager).scalar()
+        )
+        if not manager_role:
             return jsonify({"message": "Manager not found"}), 404
-        if manager_user.role not in ["admin", "manager"]:
+        if manager_role not in ["admin", "manager"]:
             return jsonify({"message": "Manager must be an admin or manager"}), 400
 
     # Update the project fields if provided
-    if project_name:
-        project.project_name = project_name
-    if description:
-        project.description = description
-    if status:
-        if status not in ["not started", "in progress", "complete"]:
-            return jsonify({"message": "Invalid status value"}), 400
-        project.status = status
-    if scope:
-        project.scope = scope
-    if manager:
-        project.manager = manager
-    if start_date:
-        try:
-            start_date = datetime.strptime(start_date, "%Y-%m-%d").date()
-            project.start_date = start_date
-        except ValueError:
-            return jsonify({"message": "Invalid date format. Use YYYY-MM-DD."}), 400
-    if end_date:
-        try:
-            end_date = datetime.strptime(end_date, "%Y-%m-%d").date()
-            project.end_date = end_date
-        except ValueError:
-            return jsonify({"message": "Invalid date format. Use YYYY-MM-DD."}), 400
+    if body.project_name:
+        project.name = body.project_name
+    if body.description:
+        project.description = body.description
+    if body.status:
+        project.status = body.status
+    if body.scope:
+        project.scope = body.scope
+    previous_manager = project.manager
+    if body.manager:
+        project.manager = body.manager
+    if body.start_date:
+        project.start_date = body.start_date
+    if body.end_date:
+        project.end_date = body.end_date
+
+    # Nothing actually changed: skip the UPDATE and leave the audit stamps alone
+    if not db.session.is_modified(project):
+        return jsonify({"message": "No changes"}), 200
 
-    project.updated_at = datetime.utcnow()
     project.updated_by = current_user_id
-
     db.session.commit()
+    if project.manager != previous_manager:
+        invalidate_project_access(previous_manager, project_id)
+        invalidate_project_access(project.manager, project_id)
 
     return jsonify({"message": "Project updated successfully"}), 200
 
@@ -409,7 +473,7 @@ def update_project(project_id):
     }
 )
 def get_project(project_id):
-    project = projects.query.get(project_id)
+    project = db.session.get(projects, project_id)
     if not project:
         return jsonify({"message": "Project not found"}), 404
 
@@ -420,11 +484,11 @@ def get_project(project_id):
         "scope": project.scope,
         "status": project.status,
         "manager": project.manager,
-        "start_date": project.start_date.strftime("%Y-%m-%d"),
-        "end_date": project.end_date.strftime("%Y-%m-%d") if project.end_date else None,
+        "start_date": project.start_date,
+        "end_date": project.end_date,
     }
 
-    return jsonify(project_data), 200
+    return conditional_json(project_data)
 
 
 @admin_project_bp.route("/assign-project", methods=["POST"])
@@ -498,39 +562,140 @@ def get_project(project_id):
     }
 )
 def assign_project():
-    data = request.get_json()
-    project_id = data.get("project_id")
-    employee_id = data.get("employee_id")
-
-    # Validate the input data
-    if not project_id or not employee_id:
-        return jsonify({"message": "All fields are required"}), 400
-
-    # Check if the project exists
-    project = projects.query.get(project_id)
-    if not project:
+    body = AssignmentBody.model_validate_json(request.get_data())
+    project_id, employee_id = body.project_id, body.employee_id
+
+    # Check that both the project and the user exist in one round trip
+    project_exists, user_exists = db.session.execute(
+        db.select(
+            db.select(projects.id).where(projects.id == project_id).exists(),
+            db.select(User.employee_id).where(User.employee_id == employee_id).exists(),
+        )
+    ).one()
+    if not project_exists:
         return jsonify({"message": "Project not found"}), 404
-
-    # Check if the user exists
-    user_to_assign = User.query.filter_by(employee_id=employee_id).first()
-    if not user_to_assign:
+    if not user_exists:
         return jsonify({"message": "User not found"}), 404
 
-    # Check if the user is already assigned to the project
-    existing_assignment = assignments.query.filter_by(
-        project_id=project_id, employee_id=employee_id
-    ).first()
-    if existing_assignment:
+    # Create a new assignment entry; uq_assign_proj_emp on (project_id,
+    # employee_id) rejects duplicates, so there is no separate pre-check
+    new_assignment = assignments(employee_id=employee_id, project_id=project_id)
+    db.session.add(new_assignment)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
         return jsonify({"message": "User is already assigned to this project"}), 400
+    invalidate_project_access(employee_id, project_id)
+
+    return jsonify({"message": "User assigned to project successfully"}), 201
+
+
+@admin_project_bp.route("/assign-project-bulk", methods=["POST"])
+@roles_required("admin")
+@swag_from(
+    {
+        "tags": ["Admin Projects"],
+        "summary": "Assign several users to a project",
+        "description": "Assign several users to a project in one request. Users already assigned are skipped.",
+        "security": [{"BearerAuth": []}],
+        "consumes": ["application/json"],
+        "parameters": [
+            {
+                "name": "body",
+                "in": "body",
+                "required": True,
+                "schema": {
+                    "type": "object",
+                    "properties": {
+                        "project_id": {
+                            "type": "integer",
+                            "description": "The ID of the project to assign.",
+                        },
+                        "employee_ids": {
+                            "type": "array",
+                            "items": {"type": "string"},
+                            "description": "The IDs of the employees to assign to the project.",
+                        },
+                    },
+                    "required": ["project_id", "employee_ids"],
+                },
+            }
+        ],
+        "responses": {
+            201: {
+                "description": "Users assigned to project successfully.",
+                "schema": {
+                    "type": "object",
+                    "properties": {
+                        "message": {"type": "string"},
+                        "assigned": {"type": "array", "items": {"type": "string"}},
+                        "already_assigned": {
+                            "type": "array",
+                            "items": {"type": "string"},
+                        },
+                    },
+                },
+            },
+            400: {"description": "Bad request."},
+            404: {"description": "Project or user not found."},
+        },
+    }
+)
+def assign_project_bulk():
+    body = BulkAssignmentBody.model_validate_json(request.get_data())
+    project_id = body.project_id
+    # Keep the caller's order but drop repeated IDs
+    employee_ids = list(dict.fromkeys(body.employee_ids))
 
-    # Create a new assignment entry in the database
-    new_assignment = assignments(
-        employee_id=employee_id, project_id=project_id, assigned_at=datetime.utcnow()
+    if not db.session.get(projects, project_id):
+        return jsonify({"message": "Project not found"}), 404
+
+    # One IN query each for the known users and the existing assignments
+    known = set(
+        db.session.execute(
+            select(User.employee_id).where(User.employee_id.in_(employee_ids))
+        ).scalars()
     )
-    db.session.add(new_assignment)
-    db.session.commit()
+    unknown = [employee_id for employee_id in employee_ids if employee_id not in known]
+    if unknown:
+        return jsonify({"message": f"User not found: {', '.join(unknown)}"}), 404
+
+    already_assigned = set(
+        db.session.execute(
+            select(assignments.employee_id).where(
+                assignments.project_id == project_id,
+                assignments.employee_id.in_(employee_ids),
+            )
+        ).scalars()
+    )
+    new_ids = [e for e in employee_ids if e not in already_assigned]
 
-    return jsonify({"message": "User assigned to project successfully"}), 201
+    # All new rows go in as one executemany inside a single transaction
+    if new_ids:
+        db.session.execute(
+            insert(assignments),
+            [{"project_id": project_id, "employee_id": e} for e in new_ids],
+        )
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Someone assigned one of them since the check above
+            db.session.rollback()
+            return jsonify({"message": "User is already assigned to this project"}), 400
+        for employee_id in new_ids:
+            invalidate_project_access(employee_id, project_id)
+
+    return (
+        jsonify(
+            {
+                "message": "Users assigned to project successfully",
+                "assigned": new_ids,
+                "already_assigned": [e for e in employee_ids if e in already_assigned],
+            }
+        ),
+        201,
+    )
 
 
 @admin_project_bp.route("/remove-assignment", methods=["POST"])
@@ -564,18 +729,7 @@ def assign_project():
             }
         ],
         "responses": {
-            200: {
-                "description": "User removed from project successfully.",
-                "schema": {
-                    "type": "object",
-                    "properties": {
-                        "message": {
-                            "type": "string",
-                            "example": "Assignment removed successfully",
-                        }
-                    },
-                },
-            },
+            204: {"description": "User removed from project successfully."},
             400: {
                 "description": "Bad request.",
                 "schema": {
@@ -604,26 +758,19 @@ def assign_project():
     }
 )
 def remove_assignment():
-    data = request.get_json()
-    project_id = data.get("project_id")
-    employee_id = data.get("employee_id")
-
-    # Validate the input data
-    if not project_id or not employee_id:
-        return jsonify({"message": "All fields are required"}), 400
+    body = AssignmentBody.model_validate_json(request.get_data())
+    project_id, employee_id = body.project_id, body.employee_id
 
-    # Check if the assignment exists
-    assignment = assignments.query.filter_by(
+    # Delete directly; a zero row count means the assignment didn't exist
+    deleted = assignments.query.filter_by(
         project_id=project_id, employee_id=employee_id
-    ).first()
-    if not assignment:
-        return jsonify({"message": "Assignment not found"}), 404
-
-    # Remove the assignment from the database
-    db.session.delete(assignment)
+    ).delete(synchronize_session=False)
     db.session.commit()
+    if not deleted:
+        return jsonify({"message": "Assignment not found"}), 404
+    invalidate_project_access(employee_id, project_id)
 
-    return jsonify({"message": "Assignment removed successfully"}), 200
+    return "", 204
 
 
 @admin_project_bp.route("/archive-project/<int:project_id>", methods=["POST"])
@@ -644,18 +791,7 @@ def remove_assignment():
             }
         ],
         "responses": {
-            200: {
-                "description": "Project archived successfully.",
-                "schema": {
-                    "type": "object",
-                    "properties": {
-                        "message": {
-                            "type": "string",
-                            "example": "Project archived successfully",
-                        }
-                    },
-                },
-            },
+            204: {"description": "Project archived successfully."},
             404: {
                 "description": "Project not found.",
                 "schema": {
@@ -672,13 +808,12 @@ def remove_assignment():
     }
 )
 def archive_project(project_id):
-    # Get the project to archive
-    project = projects.query.get(project_id)
-    if not project:
-        return jsonify({"message": "Project not found"}), 404
-
-    # Archive the project (you can implement your own archiving logic here)
-    project.archived = True
+    # Archive with a single UPDATE; a zero row count means no such project
+    updated = projects.query.filter_by(id=project_id).update(
+        {"archived": True}, synchronize_session=False
+    )
     db.session.commit()
+    if not updated:
+        return jsonify({"message": "Project not found"}), 404
 
-    return jsonify({"message": "Project archived successfully"}), 200
+    return "", 204
@@ -1,13 +1,29 @@
-from flask import Blueprint, request, jsonify
-from app import db
-from app.models import User, vms
+from flask import Blueprint, request, jsonify, current_app
+import orjson
+from app import db, cache_region, socketio
+from app.models import User, USER_LIST_CACHE_KEY
+from sqlalchemy import or_
 from flasgger import swag_from
 from app.utils.auth_utils import roles_required
-from app.utils.vm_utils import create_vms
+from app.utils.vm_utils import provision_user_vms
+from app.utils.json_utils import conditional_json
 
 admin_user_bp = Blueprint("admin blueprint for user management", __name__)
 
 
+def _user_list_json():
+    """Returns the serialized user listing, cached until any user row changes."""
+
+    def load():
+        # Plain rows of the five listed columns; no ORM instances are hydrated
+        rows = db.session.query(
+            User.employee_id, User.name, User.email, User.role, User.status
+        ).all()
+        return orjson.dumps({"users": [row._asdict() for row in rows]})
+
+    return cache_region.get_or_create(USER_LIST_CACHE_KEY, load)
+
+
 @admin_user_bp.route("/get-all-users", methods=["GET"])
 @roles_required("admin")
 @swag_from(
@@ -30,18 +46,7 @@ admin_user_bp = Blueprint("admin blueprint for user management", __name__)
     }
 )
 def get_all_users():
-    users = User.query.all()
-    user_list = [
-        {
-            "employee_id": user.employee_id,
-            "name": user.name,
-            "email": user.email,
-            "role": user.role,
-            "status": user.status,
-        }
-        for user in users
-    ]
-    return jsonify({"users": user_list}), 200
+    return conditional_json(_user_list_json())
 
 
 @admin_user_bp.route("/create-user", methods=["POST"])
@@ -81,31 +86,16 @@ def create_user():
     name = data.get("name")
     email = data.get("email")
     password = data.get("password")
-    role = data.get("role", "tester").lower()
+    role = (data.get("role") or "tester").lower()
 
-    if (
-        User.query.filter_by(employee_id=employee_id).first()
-        or User.query.filter_by(email=email).first()
-    ):
-        return jsonify({"error": "User with this ID or email already exists"}), 400
-
-    isinstance = create_vms(employee_id)
-    vm1 = vms(
-        employee_id=employee_id,
-        instance_id=isinstance["linux"],
-        instance_os="linux",
-        guacamole_url=None,
+    # One query covers both uniqueness checks and fetches a single column
+    existing = (
+        db.session.query(User.employee_id)
+        .filter(or_(User.employee_id == employee_id, User.email == email))
+        .first()
     )
-    vm2 = vms(
-        employee_id=employee_id,
-        instance_id=isinstance["windows"],
-        instance_os="windows",
-        guacamole_url=None,
-    )
-
-    db.session.add(vm1)
-    db.session.add(vm2)
-    db.session.commit()
+    if existing:
+        return jsonify({"error": "User with this ID or email already exists"}), 400
 
     new_user = User(
         employee_id=employee_id,
@@ -117,6 +107,13 @@ def create_user():
     db.session.add(new_user)
     db.session.commit()
 
+    # Launching EC2 instances takes seconds; do it off the request so the
+    # worker is free meanwhile. The VM rows appear once AWS has answered;
+    # failures are logged and can be retried with /admin/vm/provision-vms.
+    socketio.start_background_task(
+        provision_user_vms, current_app._get_current_object(), employee_id
+    )
+
     # user recives an email with the password and a link to change it
     # send_email(new_user.email, 'Welcome to the system', f'Your password is: {password}')
     return (
@@ -166,9 +163,9 @@ def create_user():
 def update_role():
     data = request.get_json()
     employee_id = data.get("employee_id")
-    new_role = data.get("role").lower()
+    new_role = (data.get("role") or "").lower()
 
-    user = User.query.filter_by(employee_id=employee_id).first()
+    user = db.session.get(User, employee_id)
     if not user:
         return jsonify({"error": "User not found"}), 404
 
@@ -211,18 +208,7 @@ def update_role():
 )
 @roles_required("admin")
 def get_users():
-    users = User.query.all()
-    user_list = [
-        {
-            "employee_id": user.employee_id,
-            "name": user.name,
-            "email": user.email,
-            "role": user.role,
-            "status": user.status,
-        }
-        for user in users
-    ]
-    return jsonify({"users": user_list}), 200
+    return conditional_json(_user_list_json())
 
 
 @admin_user_bp.route("/soft-delete-user", methods=["PUT"])
@@ -254,7 +240,7 @@ def soft_delete_user():
     data = request.get_json()
     employee_id = data.get("employee_id")
 
-    user = User.query.filter_by(employee_id=employee_id).first()
+    user = db.session.get(User, employee_id)
 
     if not user:
         return jsonify({"error": "User not found"}), 404
@@ -309,7 +295,7 @@ def restore_user():
     data = request.get_json()
     employee_id = data.get("employee_id")
 
-    user = User.query.filter_by(employee_id=employee_id).first()
+    user = db.session.get(User, employee_id)
 
     if not user:
         return jsonify({"error": "User not found"}), 404
@@ -341,7 +327,7 @@ def change_password():
     employee_id = data.get("employee_id")
     new_password = data.get("new_password")
 
-    user = User.query.filter_by(employee_id=employee_id).first()
+    user = db.session.get(User, employee_id)
 
     if not user:
         return jsonify({"error": "User not found"}), 404
@@ -366,7 +352,7 @@ def change_email():
     employee_id = data.get("employee_id")
     new_email = data.get("new_email")
 
-    user = User.query.filter_by(employee_id=employee_id).first()
+    user = db.session.get(User, employee_id)
 
     if not user:
         return jsonify({"error": "User not found"}), 404
@@ -397,10 +383,10 @@ def update_user():
     employee_id = data.get("employee_id")
     new_name = data.get("name")
     new_email = data.get("email")
-    new_role = data.get("role").lower()
+    new_role = (data.get("role") or "").lower()
     password = data.get("password")
 
-    user = User.query.filter_by(employee_id=employee_id).first()
+    user = db.session.get(User, employee_id)
     if not user:
         return jsonify({"error": "User not found"}), 404
     if new_name:
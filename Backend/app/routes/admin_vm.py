@@ -1,10 +1,16 @@
-from flask import Blueprint, request, jsonify
-from app import db
+from flask import Blueprint, request, jsonify, current_app
+from app import db, socketio
 from app.models import User
 from flasgger import swag_from
 from app.utils.auth_utils import roles_required
+from app.utils.db_utils import dev_raiseload
 from app.utils.vm_utils import create_vms
 from app.utils.vm_utils import (
+    VALID_INSTANCE_OS,
+    cached_instance_states,
+    get_ec2_client,
+    missing_vm_oses,
+    provision_user_vms,
     start_vm_util,
     stop_vm_util,
     vm_status_util,
@@ -13,6 +19,9 @@ from app.utils.vm_utils import (
 
 admin_vm_bp = Blueprint("Admin blueprint for vm management", __name__)
 
+# Rows fetched (and status-checked) per round trip while streaming get-all-vms
+VM_PAGE_SIZE = 1000
+
 
 @admin_vm_bp.route("/start-vm", methods=["POST"])
 @roles_required("admin")
@@ -54,16 +63,16 @@ admin_vm_bp = Blueprint("Admin blueprint for vm management", __name__)
 def start_vm():
     """Start a VM for a user."""
     employee_id = request.form.get("employee_id")
-    instance_os = request.form.get("instance_os").lower()
+    instance_os = request.form.get("instance_os", "").lower()
 
     if not employee_id or not instance_os:
         return jsonify({"error": "Employee ID and instance OS are required"}), 400
 
-    user = User.query.filter_by(employee_id=employee_id).first()
+    user = db.session.get(User, employee_id)
     if not user:
         return jsonify({"error": "User not found"}), 404
 
-    if instance_os not in ["linux", "windows"]:
+    if instance_os not in VALID_INSTANCE_OS:
         return jsonify({"error": "Invalid instance os"}), 400
 
     try:
@@ -112,16 +121,16 @@ def start_vm():
 def stop_vm():
     """Stop a VM for a user."""
     employee_id = request.form.get("employee_id")
-    instance_os = request.form.get("instance_os").lower()
+    instance_os = request.form.get("instance_os", "").lower()
 
     if not employee_id or not instance_os:
         return jsonify({"error": "Employee ID and instance OS are required"}), 400
 
-    user = User.query.filter_by(employee_id=employee_id).first()
+    user = db.session.get(User, employee_id)
     if not user:
         return jsonify({"error": "User not found"}), 404
 
-    if instance_os not in ["linux", "windows"]:
+    if instance_os not in VALID_INSTANCE_OS:
         return jsonify({"error": "Invalid instance os"}), 400
 
     try:
@@ -170,16 +179,16 @@ def stop_vm():
 def restart_vm():
     """Restart a VM for a user."""
     employee_id = request.form.get("employee_id")
-    instance_os = request.form.get("instance_os").lower()
+    instance_os = request.form.get("instance_os", "").lower()
 
     if not employee_id or not instance_os:
         return jsonify({"error": "Employee ID and instance OS are required"}), 400
 
-    user = User.query.filter_by(employee_id=employee_id).first()
+    user = db.session.get(User, employee_id)
     if not user:
         return jsonify({"error": "User not found"}), 404
 
-    if instance_os not in ["linux", "windows"]:
+    if instance_os not in VALID_INSTANCE_OS:
         return jsonify({"error": "Invalid instance os"}), 400
 
     try:
@@ -233,7 +242,7 @@ def vm_status():
     if not employee_id:
         return jsonify({"error": "Employee ID and instance OS are required"}), 400
 
-    user = User.query.filter_by(employee_id=employee_id).first()
+    user = db.session.get(User, employee_id)
     if not user:
         return jsonify({"error": "User not found"}), 404
     try:
@@ -243,6 +252,58 @@ def vm_status():
         return jsonify({"error": f"Error retrieving VM status"}), 500
 
 
+@admin_vm_bp.route("/provision-vms", methods=["POST"])
+@roles_required("admin")
+@swag_from(
+    {
+        "tags": ["Admin VMs"],
+        "description": "Launch any VMs a user is missing, e.g. after provisioning failed when the user was created.",
+        "security": [{"BearerAuth": []}],
+        "parameters": [
+            {
+                "name": "employee_id",
+                "in": "formData",
+                "type": "string",
+                "required": True,
+                "description": "The employee ID of the user to provision VMs for.",
+            },
+        ],
+        "responses": {
+            202: {
+                "description": "Provisioning started",
+                "schema": {
+                    "type": "object",
+                    "properties": {
+                        "message": {"type": "string"},
+                        "instance_os": {"type": "array", "items": {"type": "string"}},
+                    },
+                },
+            },
+            400: {"description": "Bad request"},
+            404: {"description": "User not found"},
+            409: {"description": "User already has all VMs"},
+        },
+    }
+)
+def provision_vms():
+    """Launch the VMs a user is missing."""
+    employee_id = request.form.get("employee_id")
+    if not employee_id:
+        return jsonify({"error": "Employee ID is required"}), 400
+
+    if not db.session.get(User, employee_id):
+        return jsonify({"error": "User not found"}), 404
+
+    missing = missing_vm_oses(employee_id)
+    if not missing:
+        return jsonify({"error": "User already has all VMs"}), 409
+
+    socketio.start_background_task(
+        provision_user_vms, current_app._get_current_object(), employee_id
+    )
+    return jsonify({"message": "VM provisioning started", "instance_os": missing}), 202
+
+
 @admin_vm_bp.route("/get-all-vms", methods=["GET"])
 @roles_required("admin")
 @swag_from(
@@ -279,7 +340,11 @@ def vm_status():
                                     },
                                 },
                             },
-                        }
+                        },
+                        "error": {
+                            "type": "string",
+                            "description": "Present only if the list was cut short",
+                        },
                     },
                 },
             },
@@ -291,66 +356,62 @@ def get_all_vms():
     """Get information about all VMs assigned to users."""
     try:
         from app.models import vms, User
-        import boto3
-        from flask import current_app
-        from sqlalchemy.orm import joinedload
-
-        # Get all VMs from database with associated user info
-        vm_entries = (
-            db.session.query(vms, User.name, User.email)
-            .join(User, vms.employee_id == User.employee_id)
-            .all()
+        import orjson
+        from flask import Response, stream_with_context
+        from sqlalchemy.orm import selectinload
+
+        # Get VMs in pages of VM_PAGE_SIZE, each page's users in one batched IN query
+        query = (
+            db.select(vms)
+            .options(*dev_raiseload(selectinload(vms.user)))
+            .order_by(vms.id)
+            .execution_options(yield_per=VM_PAGE_SIZE)
         )
 
         # Get EC2 client for checking actual status
-        ec2 = boto3.client("ec2", region_name=current_app.config.get("DEFAULT_REGION"))
-
-        # Collect all instance IDs for batch status check
-        instance_ids = [vm.instance_id for vm, _, _ in vm_entries]
-
-        # Get status for all instances in one API call
-        instance_statuses = {}
-        if instance_ids:
-            try:
-                response = ec2.describe_instance_status(
-                    InstanceIds=instance_ids, IncludeAllInstances=True
-                )
-
-                # Create a dict for quick lookup
-                for instance in response.get("InstanceStatuses", []):
-                    instance_id = instance["InstanceId"]
-                    status = instance["InstanceState"]["Name"]
-                    instance_statuses[instance_id] = status
-            except Exception as e:
-                # Fall back to individual status checks if batch fails
-                print(f"Error in batch status check: {str(e)}")
-                pass
-
-        # Build the response
-        vm_list = []
-        for vm, user_name, user_email in vm_entries:
-            # Get status from our batch results or default to DB value
-            status = instance_statuses.get(vm.instance_id, vm.status)
-
-            vm_list.append(
-                {
-                    "id": vm.id,
-                    "instance_id": vm.instance_id,
-                    "employee_id": vm.employee_id,
-                    "user_name": user_name,
-                    "user_email": user_email,
-                    "instance_os": vm.instance_os,
-                    "status": status,
-                    "guacamole_url": vm.guacamole_url,
-                    "created_at": vm.created_at.isoformat() if vm.created_at else None,
-                    "updated_at": vm.updated_at.isoformat() if vm.updated_at else None,
-                }
-            )
-
-        return jsonify({"vms": vm_list}), 200
-
+        ec2 = get_ec2_client(current_app.config.get("DEFAULT_REGION"))
     except Exception as e:
         import traceback
 
         print(traceback.format_exc())
         return jsonify({"error": f"Error retrieving VM information: {str(e)}"}), 500
+
+    def generate():
+        # Emit {"vms": [...]} one page at a time so memory stays flat
+        yield b'{"vms":['
+        separator = b""
+        try:
+            # Executed here so the rows are read inside the streaming context
+            for page in db.session.execute(query).scalars().partitions():
+                # Reuse recently seen states; only stale or unseen IDs go to EC2
+                instance_statuses = cached_instance_states(
+                    ec2, [vm.instance_id for vm in page]
+                )
+                for vm in page:
+                    # EC2's state, "unknown" if its batch failed, or the DB
+                    # value for instances EC2 didn't list
+                    status = instance_statuses.get(vm.instance_id, vm.status)
+                    row = {
+                        "id": vm.id,
+                        "instance_id": vm.instance_id,
+                        "employee_id": vm.employee_id,
+                        "user_name": vm.user.name,
+                        "user_email": vm.user.email,
+                        "instance_os": vm.instance_os,
+                        "status": status,
+                        "guacamole_url": vm.guacamole_url,
+                        # orjson writes datetimes as ISO 8601 itself
+                        "created_at": vm.created_at,
+                        "updated_at": vm.updated_at,
+                    }
+                    yield separator + orjson.dumps(row)
+                    separator = b","
+        except Exception:
+            # Headers are already sent, so the status can't change; flag the
+            # list as incomplete in the body instead of ending it cleanly
+            current_app.logger.exception("Error streaming VM list")
+            yield b'],"error":"Error retrieving VM information"}'
+            return
+        yield b"]}"
+
+    return Response(stream_with_context(generate()), mimetype="application/json")
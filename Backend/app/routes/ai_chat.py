@@ -1,15 +1,37 @@
-from flask import Blueprint, request, jsonify
-from app import db
+from flask import (
+    Blueprint,
+    request,
+    jsonify,
+    Response,
+    stream_with_context,
+    current_app,
+)
+from flask_jwt_extended import get_jwt_identity
+from flask_limiter.util import get_remote_address
+import orjson
+from app import db, limiter
 from app.models import User
 from flasgger import swag_from
 from app.utils.auth_utils import roles_required
-from app.utils.ai_utils import get_answer_from_ai
+from app.utils.ai_utils import get_answer_from_ai, stream_answer_from_ai
 
 ai_chat_bp = Blueprint("AI Chat", __name__)
 
 
+@ai_chat_bp.errorhandler(429)
+def rate_limited(e):
+    return jsonify({"error": "Too many requests, please try again later"}), 429
+
+
 @ai_chat_bp.route("/ask", methods=["POST"])
 @roles_required("admin", "tester", "manager")
+# Every question costs model quota; limit each user, and each client address
+@limiter.limit(
+    lambda: current_app.config["AI_USER_RATE_LIMIT"], key_func=get_jwt_identity
+)
+@limiter.limit(
+    lambda: current_app.config["AI_IP_RATE_LIMIT"], key_func=get_remote_address
+)
 @swag_from(
     {
         "tags": ["AI Chat"],
@@ -24,6 +46,13 @@ ai_chat_bp = Blueprint("AI Chat", __name__)
                 "required": True,
                 "description": "The question to ask the AI model.",
             },
+            {
+                "name": "stream",
+                "in": "formData",
+                "type": "boolean",
+                "required": False,
+                "description": "Stream the answer as Server-Sent Events (also chosen by Accept: text/event-stream).",
+            },
         ],
         "responses": {
             200: {
@@ -39,6 +68,7 @@ ai_chat_bp = Blueprint("AI Chat", __name__)
                 },
             },
             400: {"description": "Bad request"},
+            429: {"description": "Rate limit exceeded"},
             500: {"description": "Internal server error"},
         },
     }
@@ -48,6 +78,23 @@ def ask_ai():
     if not question:
         return jsonify({"error": "Question is required"}), 400
 
+    # Opt-in streaming: send chunks as they arrive instead of after the whole answer
+    if (
+        request.form.get("stream") in ("1", "true")
+        or request.accept_mimetypes.best == "text/event-stream"
+    ):
+
+        def events():
+            for chunk in stream_answer_from_ai(question):
+                yield b"data: " + orjson.dumps({"delta": chunk}) + b"\n\n"
+            yield b"event: done\ndata: {}\n\n"
+
+        return Response(
+            stream_with_context(events()),
+            mimetype="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
     # Call the AI model to get the answer
     answer = get_answer_from_ai(question)
 
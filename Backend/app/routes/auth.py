@@ -1,4 +1,4 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app
 from werkzeug.utils import secure_filename
 from flask_jwt_extended import (
     create_access_token,
@@ -7,11 +7,12 @@ from flask_jwt_extended import (
     get_jwt,
     unset_access_cookies,
 )
-from app import db
+from app import db, socketio
 from app.models import User, PasswordReset
 from app.utils.auth_utils import roles_required
+from app.utils.mail_utils import send_password_reset_email
 import os
-import uuid
+import secrets
 from flasgger import swag_from
 from datetime import datetime, timezone
 
@@ -67,14 +68,21 @@ def login():
     data = request.get_json()
     employee_id = data.get("employee_id")
     password = data.get("password")
-    user = User.query.filter_by(employee_id=employee_id, status="active").first()
+    user = db.session.get(User, employee_id) if employee_id else None
 
-    if not user or not user.check_password(password):
+    if not user or user.status != "active" or not user.check_password(password):
         return jsonify({"error": "Invalid credentials"}), 401
+    if db.session.is_modified(user):
+        db.session.commit()  # the hash was upgraded to the current cost
 
+    # No role claim: roles_required checks the live identity, so a role
+    # change applies before the token expires; the role is in the body instead
     access_token = create_access_token(identity=user.employee_id)
-    set_access_cookies
-    return jsonify({"access_token": access_token, "role": user.role}), 200
+    response = jsonify({"access_token": access_token, "role": user.role})
+    # Browsers can authenticate with the HttpOnly cookie (plus CSRF header);
+    # the token stays in the body for clients sending a Bearer header
+    set_access_cookies(response, access_token)
+    return response, 200
 
 
 @auth_bp.route("/request-password-reset", methods=["POST"])
@@ -113,25 +121,27 @@ def login():
 def request_password_reset():
     data = request.get_json()
     employee_id = data.get("employee_id")
-    user = User.query.filter_by(employee_id=employee_id).first()
+    user = db.session.get(User, employee_id)
 
     if not user:
         return jsonify({"error": "User not found"}), 404
 
     # Generate a secure reset token
-    reset_token = str(uuid.uuid4())
-
-    # Delete any existing reset tokens for this user
-    PasswordReset.query.filter_by(employee_id=employee_id).delete()
+    reset_token = secrets.token_bytes(32)
 
-    # Create a new password reset request
-    password_reset = PasswordReset(employee_id=employee_id, reset_token=reset_token)
-    db.session.add(password_reset)
-    db.session.commit()
+    # Store it, replacing any earlier token for this user
+    PasswordReset.issue(employee_id, reset_token)
 
-    reset_link = f"{request.url_root}auth/reset-password/{reset_token}"
+    reset_link = f"{request.url_root}auth/reset-password/{reset_token.hex()}"
 
-    # Send reset link to user's email (this is a placeholder, implement actual email sending)
+    # SMTP can take seconds (and retries); send from a background task so
+    # the request returns as soon as the token is stored
+    socketio.start_background_task(
+        send_password_reset_email,
+        current_app._get_current_object(),
+        user.email,
+        reset_link,
+    )
     return (
         jsonify({"message": "Password reset email sent"}),
         200,
@@ -177,12 +187,17 @@ def request_password_reset():
     }
 )
 def reset_password(token):
-    password_reset = PasswordReset.query.filter_by(reset_token=token).first()
+    try:
+        reset_token = bytes.fromhex(token)
+    except ValueError:
+        return jsonify({"error": "Invalid or expired token"}), 400
+
+    password_reset = PasswordReset.find_by_token(reset_token)
 
     if not password_reset or password_reset.is_expired():
         return jsonify({"error": "Invalid or expired token"}), 400
 
-    user = User.query.filter_by(employee_id=password_reset.employee_id).first()
+    user = db.session.get(User, password_reset.employee_id)
 
     if not user:
         return jsonify({"error": "User not found"}), 404
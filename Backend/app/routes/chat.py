@@ -1,19 +1,92 @@
-from flask import Blueprint, request, jsonify, current_app, send_file
+from flask import Blueprint, request, jsonify, current_app, send_file, g, redirect
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from flask_socketio import emit, join_room, leave_room
-from datetime import datetime
-from app import db
-from app.models import User, projects, assignments, ChatMessage
-from app.utils.auth_utils import roles_required
+from datetime import datetime, timezone
+from app import db, socketio
+from app.models import User, ChatMessage, projects
+from app.utils.auth_utils import roles_required, project_access_required
+from app.utils.storage_utils import upload_chat_file, chat_file_download_url
 from flasgger import swag_from
-import os, uuid
-from werkzeug.utils import secure_filename
+from sqlalchemy import (
+    bindparam,
+    delete,
+    exists,
+    insert,
+    lambda_stmt,
+    select,
+    tuple_,
+    update,
+)
+from sqlalchemy.orm import joinedload
+import io, os, uuid, mimetypes
 
 chat_bp = Blueprint("chat", __name__)
 
+# Built once so the hot history query skips SQL generation on every request;
+# only the sender's name is rendered, so narrow the sender join
+_LATEST_MESSAGES = lambda_stmt(
+    lambda: select(ChatMessage)
+    .options(
+        joinedload(ChatMessage.sender).load_only(User.employee_id, User.name),
+    )
+    .where(ChatMessage.project_id == bindparam("pid"))
+    .order_by(ChatMessage.timestamp.desc(), ChatMessage.id.desc())
+    .offset(bindparam("off"))
+    .limit(bindparam("lim"))
+)
+# Keyset page: the messages strictly older than the (timestamp, id) cursor,
+# read as an index range scan however deep into the history it is
+_MESSAGES_BEFORE = lambda_stmt(
+    lambda: select(ChatMessage)
+    .options(
+        joinedload(ChatMessage.sender).load_only(User.employee_id, User.name),
+    )
+    .where(
+        ChatMessage.project_id == bindparam("pid"),
+        tuple_(ChatMessage.timestamp, ChatMessage.id)
+        < tuple_(
+            bindparam("ts", type_=ChatMessage.timestamp.type),
+            bindparam("bid", type_=ChatMessage.id.type),
+        ),
+    )
+    .order_by(ChatMessage.timestamp.desc(), ChatMessage.id.desc())
+    .limit(bindparam("lim"))
+)
+
+
+# Chat attachments are capped at 5MB
+MAX_FILE_SIZE = 5 * 1024 * 1024
+
+
+@chat_bp.errorhandler(413)
+def file_too_large(e):
+    return jsonify({"error": "File too large. Maximum size is 5MB"}), 400
+
+
+def _save_capped(file, file_path, max_size):
+    """Copies an upload to disk in UPLOAD_COPY_BUFFER chunks; returns False,
+    removing the partial file, as soon as more than max_size bytes have been read."""
+    buffer_size = current_app.config["UPLOAD_COPY_BUFFER"]
+    written = 0
+    with open(file_path, "wb") as out:
+        while chunk := file.stream.read(buffer_size):
+            written += len(chunk)
+            if written > max_size:
+                break
+            out.write(chunk)
+        else:
+            if hasattr(os, "posix_fadvise"):
+                # Attachments are rarely read back soon; keep them out of the page cache
+                out.flush()
+                os.posix_fadvise(out.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+            return True
+    os.unlink(file_path)
+    return False
+
 
 @chat_bp.route("/messages/<int:project_id>", methods=["GET"])
 @roles_required("admin", "manager", "tester")
+@project_access_required
 @swag_from(
     {
         "tags": ["Chat"],
@@ -42,6 +115,20 @@ chat_bp = Blueprint("chat", __name__)
                 "required": False,
                 "description": "Number of messages to skip (for pagination).",
             },
+            {
+                "name": "before_ts",
+                "in": "query",
+                "type": "string",
+                "required": False,
+                "description": "Cursor timestamp from next_cursor; use with before_id instead of offset.",
+            },
+            {
+                "name": "before_id",
+                "in": "query",
+                "type": "integer",
+                "required": False,
+                "description": "Cursor message ID from next_cursor.",
+            },
         ],
         "responses": {
             200: {
@@ -63,9 +150,17 @@ chat_bp = Blueprint("chat", __name__)
                                     },
                                     "is_file": {"type": "boolean"},
                                     "file_path": {"type": "string"},
+                                    "upload_pending": {
+                                        "type": "boolean",
+                                        "description": "The attachment can't be downloaded yet.",
+                                    },
                                 },
                             },
-                        }
+                        },
+                        "next_cursor": {
+                            "type": "object",
+                            "description": "before_ts/before_id of the next page, or null at the end.",
+                        },
                     },
                 },
             },
@@ -75,37 +170,27 @@ chat_bp = Blueprint("chat", __name__)
     }
 )
 def get_messages(project_id):
-    # Get the current user
-    current_user_id = get_jwt_identity()
-    user = User.query.filter_by(employee_id=current_user_id).first()
-
-    # Check if the project exists
-    project = projects.query.get(project_id)
-    if not project:
-        return jsonify({"error": "Project not found"}), 404
-
-    # Check if the user has access to the project
-    if user.role != "admin" and user.role != "manager":
-        # For testers, check if they're assigned to the project
-        assignment = assignments.query.filter_by(
-            employee_id=user.employee_id, project_id=project_id
-        ).first()
-
-        if not assignment and project.manager != user.employee_id:
-            return jsonify({"error": "User does not have access to this project"}), 403
-
     # Get pagination parameters
     limit = request.args.get("limit", 50, type=int)
     offset = request.args.get("offset", 0, type=int)
-
-    # Query the chat messages
-    messages = (
-        ChatMessage.query.filter_by(project_id=project_id)
-        .order_by(ChatMessage.timestamp.desc())
-        .offset(offset)
-        .limit(limit)
-        .all()
-    )
+    before_ts = request.args.get("before_ts")
+    before_id = request.args.get("before_id", type=int)
+
+    # Query the chat messages; a cursor, when given, replaces the offset
+    if before_ts and before_id is not None:
+        try:
+            before_ts = datetime.fromisoformat(before_ts)
+        except ValueError:
+            return jsonify({"error": "Invalid before_ts"}), 400
+        result = db.session.execute(
+            _MESSAGES_BEFORE,
+            {"pid": project_id, "ts": before_ts, "bid": before_id, "lim": limit},
+        )
+    else:
+        result = db.session.execute(
+            _LATEST_MESSAGES, {"pid": project_id, "off": offset, "lim": limit}
+        )
+    messages = result.scalars().all()
 
     # Format the messages
     messages_data = [
@@ -114,18 +199,29 @@ def get_messages(project_id):
             "content": message.content,
             "sender_id": message.employee_id,
             "sender_name": message.sender.name,
-            "timestamp": message.timestamp.isoformat(),
+            # Serialized by the orjson provider, which writes ISO 8601 itself
+            "timestamp": message.timestamp,
             "is_file": message.is_file,
             "file_path": message.file_path if message.is_file else None,
+            "upload_pending": message.upload_pending,
         }
         for message in messages
     ]
 
-    return jsonify({"messages": messages_data}), 200
+    # A full page may have older messages behind it
+    next_cursor = None
+    if messages and len(messages) == limit:
+        next_cursor = {
+            "before_ts": messages[-1].timestamp,
+            "before_id": messages[-1].id,
+        }
+
+    return jsonify({"messages": messages_data, "next_cursor": next_cursor}), 200
 
 
 @chat_bp.route("/messages/<int:project_id>", methods=["POST"])
 @roles_required("admin", "manager", "tester")
+@project_access_required
 @swag_from(
     {
         "tags": ["Chat"],
@@ -161,25 +257,6 @@ def get_messages(project_id):
     }
 )
 def send_message(project_id):
-    # Get the current user
-    current_user_id = get_jwt_identity()
-    user = User.query.filter_by(employee_id=current_user_id).first()
-
-    # Check if the project exists
-    project = projects.query.get(project_id)
-    if not project:
-        return jsonify({"error": "Project not found"}), 404
-
-    # Check if the user has access to the project
-    if user.role != "admin" and user.role != "manager":
-        # For testers, check if they're assigned to the project
-        assignment = assignments.query.filter_by(
-            employee_id=user.employee_id, project_id=project_id
-        ).first()
-
-        if not assignment and project.manager != user.employee_id:
-            return jsonify({"error": "User does not have access to this project"}), 403
-
     # Get the message content
     data = request.get_json()
     content = data.get("content")
@@ -187,25 +264,29 @@ def send_message(project_id):
     if not content or content.strip() == "":
         return jsonify({"error": "Message content is required"}), 400
 
-    # Create and save the message
-    new_message = ChatMessage(
-        project_id=project_id,
-        employee_id=user.employee_id,
-        content=content,
-        timestamp=datetime.utcnow(),
-    )
-
-    db.session.add(new_message)
+    # Save the message; RETURNING hands back the new id in the same round
+    # trip, so no refresh SELECT is needed after the commit
+    message_id = db.session.execute(
+        insert(ChatMessage)
+        .values(
+            project_id=project_id,
+            employee_id=g.identity["employee_id"],
+            content=content,
+            timestamp=datetime.now(timezone.utc),
+        )
+        .returning(ChatMessage.id)
+    ).scalar_one()
     db.session.commit()
 
     return (
-        jsonify({"message": "Message sent successfully", "message_id": new_message.id}),
+        jsonify({"message": "Message sent successfully", "message_id": message_id}),
         201,
     )
 
 
 @chat_bp.route("/upload/<int:project_id>", methods=["POST"])
 @roles_required("admin", "manager", "tester")
+@project_access_required
 @swag_from(
     {
         "tags": ["Chat"],
@@ -230,7 +311,9 @@ def send_message(project_id):
             },
         ],
         "responses": {
-            201: {"description": "File uploaded successfully."},
+            201: {
+                "description": "File uploaded successfully. With object storage the copy to the bucket finishes in the background; upload_pending is true until then."
+            },
             400: {"description": "No file uploaded or file too large."},
             403: {"description": "User does not have access to this project."},
             404: {"description": "Project not found."},
@@ -238,24 +321,9 @@ def send_message(project_id):
     }
 )
 def upload_file(project_id):
-    # Get the current user
-    current_user_id = get_jwt_identity()
-    user = User.query.filter_by(employee_id=current_user_id).first()
-
-    # Check if the project exists
-    project = projects.query.get(project_id)
-    if not project:
-        return jsonify({"error": "Project not found"}), 404
-
-    # Check if the user has access to the project
-    if user.role != "admin" and user.role != "manager":
-        # For testers, check if they're assigned to the project
-        assignment = assignments.query.filter_by(
-            employee_id=user.employee_id, project_id=project_id
-        ).first()
-
-        if not assignment and project.manager != user.employee_id:
-            return jsonify({"error": "User does not have access to this project"}), 403
+    # Werkzeug stops reading the body once it passes the cap (answered as 413);
+    # the slack leaves room for the multipart framing around the file
+    request.max_content_length = MAX_FILE_SIZE + 64 * 1024
 
     # Check if file is in the request
     if "file" not in request.files:
@@ -267,46 +335,98 @@ def upload_file(project_id):
     if file.filename == "":
         return jsonify({"error": "No file selected"}), 400
 
-    # Check file size (limit to 5MB)
-    MAX_FILE_SIZE = 5 * 1024 * 1024  # 5MB
-    if request.content_length > MAX_FILE_SIZE:
-        return jsonify({"error": "File too large. Maximum size is 5MB"}), 400
-
-    # Create chat_files directory if it doesn't exist
-    uploads_dir = os.path.join(
-        current_app.config.get("UPLOADS_DIR"), "chat_files", str(project_id)
-    )
-    os.makedirs(uploads_dir, exist_ok=True)
-
-    # Save the file with a secure filename
-    filename = secure_filename(f"{uuid.uuid4().hex}_{file.filename}")
-    file_path = os.path.join(uploads_dir, filename)
-    file.save(file_path)
+    # Store under a random name; the client's name is only kept as metadata,
+    # so it never reaches the filesystem. Keep a plain extension for MIME types
+    ext = os.path.splitext(file.filename)[1][:16]
+    filename = uuid.uuid4().hex + (ext if ext[1:].isalnum() else "")
+
+    to_bucket = bool(current_app.config.get("CHAT_FILES_BUCKET"))
+    if to_bucket:
+        # Capped at MAX_FILE_SIZE, so it is held in memory for the background
+        # upload; Werkzeug closes its spooled copy when the request ends
+        data = file.stream.read(MAX_FILE_SIZE + 1)
+        if len(data) > MAX_FILE_SIZE:
+            return jsonify({"error": "File too large. Maximum size is 5MB"}), 400
+    else:
+        # Create chat_files directory if it doesn't exist
+        uploads_dir = os.path.join(
+            current_app.config.get("UPLOADS_DIR"), "chat_files", str(project_id)
+        )
+        os.makedirs(uploads_dir, exist_ok=True)
+
+        # The byte count, not the client-supplied Content-Length, enforces the limit
+        file_path = os.path.join(uploads_dir, filename)
+        if not _save_capped(file, file_path, MAX_FILE_SIZE):
+            return jsonify({"error": "File too large. Maximum size is 5MB"}), 400
 
     # Create a chat message with file reference
-    new_message = ChatMessage(
-        project_id=project_id,
-        employee_id=user.employee_id,
-        content=f"File: {file.filename}",
-        timestamp=datetime.utcnow(),
-        is_file=True,
-        file_path=f"/uploads/chat_files/{project_id}/{filename}",
-    )
-
-    db.session.add(new_message)
+    url_path = f"/uploads/chat_files/{project_id}/{filename}"
+    message_id = db.session.execute(
+        insert(ChatMessage)
+        .values(
+            project_id=project_id,
+            employee_id=g.identity["employee_id"],
+            content=f"File: {file.filename}",
+            original_filename=file.filename[:255],
+            timestamp=datetime.now(timezone.utc),
+            is_file=True,
+            file_path=url_path,
+            upload_pending=to_bucket,
+        )
+        .returning(ChatMessage.id)
+    ).scalar_one()
     db.session.commit()
 
+    if to_bucket:
+        # The S3 round trip happens after the response; the message is
+        # downloadable once upload_pending clears
+        socketio.start_background_task(
+            _upload_to_bucket,
+            current_app._get_current_object(),
+            data,
+            project_id,
+            filename,
+            message_id,
+        )
+
     return (
         jsonify(
             {
                 "message": "File uploaded successfully",
-                "message_id": new_message.id,
-                "file_path": new_message.file_path,
+                "message_id": message_id,
+                "file_path": url_path,
+                "upload_pending": to_bucket,
             }
         ),
         201,
     )
 
+
+def _upload_to_bucket(app, data, project_id, filename, message_id):
+    """Background task: copies an attachment to S3 and marks it downloadable.
+
+    If the upload fails the message is deleted, so the chat never links to a
+    file that doesn't exist.
+    """
+    with app.app_context():
+        try:
+            upload_chat_file(io.BytesIO(data), project_id, filename)
+            db.session.execute(
+                update(ChatMessage)
+                .where(ChatMessage.id == message_id)
+                .values(upload_pending=False)
+            )
+        except Exception:
+            app.logger.exception(
+                f"Error uploading {filename} for project {project_id}"
+            )
+            db.session.rollback()
+            db.session.execute(delete(ChatMessage).where(ChatMessage.id == message_id))
+        try:
+            db.session.commit()
+        finally:
+            db.session.remove()
+
 # return all avaulabpe chats rooms for the admin
 @chat_bp.route("/rooms", methods=["GET"])
 @roles_required("admin")
@@ -333,14 +453,20 @@ def upload_file(project_id):
     }
 )
 def get_rooms():
-    # Get all chat rooms
-    rooms = db.session.query(ChatMessage.project_id).distinct().all()
-    room_list = [room[0] for room in rooms]
+    # Get all chat rooms: projects with at least one message. EXISTS stops at
+    # the first message per project instead of de-duplicating the whole table
+    rooms = db.session.execute(
+        select(projects.id).where(
+            exists().where(ChatMessage.project_id == projects.id)
+        )
+    ).scalars()
+    room_list = list(rooms)
 
     return jsonify({"rooms": room_list}), 200
 
 @chat_bp.route("/download/<int:project_id>/<filename>", methods=["GET"])
 @roles_required("admin", "manager", "tester")
+@project_access_required
 @swag_from(
     {
         "tags": ["Chat"],
@@ -367,23 +493,26 @@ def get_rooms():
             200: {"description": "File downloaded successfully."},
             403: {"description": "User does not have access to this project."},
             404: {"description": "File or project not found."},
+            409: {"description": "File is still uploading."},
         },
     }
 )
 def download_file(project_id, filename):
-    current_user_id = get_jwt_identity()
-    user = User.query.filter_by(employee_id=current_user_id).first()
-
-    project = projects.query.get(project_id)
-    if not project:
-        return jsonify({"error": "Project not found"}), 404
-
-    if user.role != "admin" and user.role != "manager":
-        assignment = assignments.query.filter_by(
-            employee_id=user.employee_id, project_id=project_id
-        ).first()
-        if not assignment and project.manager != user.employee_id:
-            return jsonify({"error": "User does not have access to this project"}), 403
+    # Offer the file under the name it was uploaded with
+    row = db.session.execute(
+        select(ChatMessage.original_filename, ChatMessage.upload_pending).where(
+            ChatMessage.project_id == project_id,
+            ChatMessage.file_path == f"/uploads/chat_files/{project_id}/{filename}",
+        )
+    ).first()
+    download_name = (row and row.original_filename) or filename
+
+    if row and row.upload_pending:
+        return jsonify({"error": "File is still uploading"}), 409
+
+    if current_app.config.get("CHAT_FILES_BUCKET"):
+        # The browser fetches the bytes from S3 directly
+        return redirect(chat_file_download_url(project_id, filename, download_name))
 
     uploads_dir = os.path.join(
         current_app.config.get("UPLOADS_DIR"), "chat_files", str(project_id)
@@ -393,4 +522,19 @@ def download_file(project_id, filename):
     if not os.path.isfile(file_path):
         return jsonify({"error": "File not found"}), 404
 
-    return send_file(file_path, as_attachment=True)
\ No newline at end of file
+    accel_prefix = current_app.config.get("X_ACCEL_REDIRECT_PREFIX")
+    if accel_prefix:
+        # Access is checked; nginx streams the bytes itself via sendfile(2)
+        response = current_app.response_class(
+            mimetype=mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        )
+        response.headers["X-Accel-Redirect"] = (
+            f"{accel_prefix.rstrip('/')}/chat_files/{project_id}/{filename}"
+        )
+        response.headers.set(
+            "Content-Disposition", "attachment", filename=download_name
+        )
+        return response
+
+    # With USE_X_SENDFILE set, send_file emits an X-Sendfile header instead
+    return send_file(file_path, as_attachment=True, download_name=download_name)
\ No newline at end of file
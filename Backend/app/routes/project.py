@@ -3,18 +3,31 @@ from werkzeug.utils import secure_filename
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from app.models import User, projects, assignments
 from flasgger import swag_from
-from app.utils.auth_utils import roles_required
+from app.utils.auth_utils import roles_required, invalidate_project_access
 from app.utils.vm_utils import (
     start_vm_util,
     stop_vm_util,
     vm_status_util,
     restart_vm_util,
 )
-from datetime import datetime
+from datetime import date
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy import or_
+from sqlalchemy.orm import selectinload
 from app import db
+from app.utils.db_utils import dev_raiseload
 
 project_bp = Blueprint("project", __name__)
 
+# Members and their names in one extra IN query instead of one query per member;
+# only the columns the listing shows are read, not whole user rows
+_WITH_MEMBERS = (
+    selectinload(projects.members)
+    .load_only(assignments.employee_id)
+    .joinedload(assignments.user, innerjoin=True)
+    .load_only(User.name)
+)
+
 
 @project_bp.route("/create-project", methods=["POST"])
 @roles_required("admin", "manager")
@@ -104,10 +117,6 @@ project_bp = Blueprint("project", __name__)
 )
 def create_project():
     current_user_id = get_jwt_identity()
-    user = User.query.filter_by(employee_id=current_user_id).first()
-    if not user:
-        return jsonify({"message": "User not found"}), 404
-
     data = request.get_json()
     # Get the form data
     project_name = data.get("project_name")
@@ -122,8 +131,8 @@ def create_project():
 
     # validate date format (YYYY-MM-DD) and check if start_date is before end_date
     try:
-        start_date = datetime.strptime(start_date, "%Y-%m-%d").date()
-        end_date = datetime.strptime(end_date, "%Y-%m-%d").date()
+        start_date = date.fromisoformat(start_date)
+        end_date = date.fromisoformat(end_date)
         if start_date >= end_date:
             return jsonify({"message": "Start date must be before end date"}), 400
     except ValueError:
@@ -194,51 +203,48 @@ def create_project():
 )
 def update_project(project_id):
     current_user_id = get_jwt_identity()
-    user = User.query.filter_by(employee_id=current_user_id).first()
-    if not user:
-        return jsonify({"message": "User not found"}), 404
-
-    # Get the project to update
-    project = projects.query.get(project_id)
-    if not project:
-        return jsonify({"message": "Project not found"}), 404
-
     data = request.get_json()
     # Get the form data
     project_name = data.get("project_name")
     description = data.get("description")
     scope = data.get("scope")
-    status = data.get("status").lower()
+    status = (data.get("status") or "").lower()
     start_date = data.get("start_date")
     end_date = data.get("end_date")
 
+    # Validate everything before touching the DB, so bad payloads cost no query
+    if status and status not in ["not started", "in progress", "complete"]:
+        return jsonify({"message": "Invalid status value"}), 400
+    try:
+        start_date = date.fromisoformat(start_date) if start_date else None
+        end_date = date.fromisoformat(end_date) if end_date else None
+    except ValueError:
+        return jsonify({"message": "Invalid date format. Use YYYY-MM-DD."}), 400
+
+    # Get the project to update
+    project = db.session.get(projects, project_id)
+    if not project:
+        return jsonify({"message": "Project not found"}), 404
+
     # Update the project fields if provided
     if project_name:
         project.name = project_name
     if description:
         project.description = description
     if status:
-        if status not in ["not started", "in progress", "complete"]:
-            return jsonify({"message": "Invalid status value"}), 400
         project.status = status
     if scope:
         project.scope = scope
     if start_date:
-        try:
-            start_date = datetime.strptime(start_date, "%Y-%m-%d").date()
-            project.start_date = start_date
-        except ValueError:
-            return jsonify({"message": "Invalid date format. Use YYYY-MM-DD."}), 400
+        project.start_date = start_date
     if end_date:
-        try:
-            end_date = datetime.strptime(end_date, "%Y-%m-%d").date()
-            project.end_date = end_date
-        except ValueError:
-            return jsonify({"message": "Invalid date format. Use YYYY-MM-DD."}), 400
+        project.end_date = end_date
 
-    project.updated_at = datetime.utcnow()
-    project.updated_by = current_user_id
+    # Nothing actually changed: skip the UPDATE and leave the audit stamps alone
+    if not db.session.is_modified(project):
+        return jsonify({"message": "No changes"}), 200
 
+    project.updated_by = current_user_id
     db.session.commit()
 
     return jsonify({"message": "Project updated successfully"}), 200
@@ -297,7 +303,7 @@ def update_project(project_id):
     }
 )
 def get_project(project_id):
-    project = projects.query.get(project_id)
+    project = projects.query.options(*dev_raiseload(_WITH_MEMBERS)).filter_by(id=project_id).first()
     if not project:
         return jsonify({"message": "Project not found"}), 404
 
@@ -309,15 +315,13 @@ def get_project(project_id):
         "members": [
             {
                 "employee_id": assignment.employee_id,
-                "name": User.query.filter_by(employee_id=assignment.employee_id)
-                .first()
-                .name,
+                "name": assignment.user.name,
             }
-            for assignment in assignments.query.filter_by(project_id=project.id).all()
+            for assignment in project.members
         ],
         "status": project.status,
-        "start_date": project.start_date.strftime("%Y-%m-%d"),
-        "end_date": project.end_date.strftime("%Y-%m-%d") if project.end_date else None,
+        "start_date": project.start_date,
+        "end_date": project.end_date,
     }
 
     return jsonify(project_data), 200
@@ -370,19 +374,21 @@ def get_project(project_id):
 )
 def get_projects():
     current_user_id = get_jwt_identity()
-    # Projects where user is manager
-    managed_projects = projects.query.filter_by(manager=current_user_id)
-    # Projects where user is assigned
-    assigned_project_ids = [
-        a.project_id
-        for a in assignments.query.filter_by(employee_id=current_user_id).all()
-    ]
-    assigned_projects = projects.query.filter(projects.id.in_(assigned_project_ids))
-    # Union and remove duplicates
-    all_projects = {p.id: p for p in managed_projects}
-    for p in assigned_projects:
-        all_projects[p.id] = p
-    projects_list = list(all_projects.values())
+    # Unarchived projects the user manages or is assigned to, each listed once
+    assigned_project_ids = db.select(assignments.project_id).where(
+        assignments.employee_id == current_user_id
+    )
+    projects_list = (
+        projects.query.options(*dev_raiseload(_WITH_MEMBERS))
+        .filter(
+            or_(
+                projects.manager == current_user_id,
+                projects.id.in_(assigned_project_ids),
+            ),
+            projects.archived == db.false(),
+        )
+        .all()
+    )
     if projects_list:
         projects_data = [
             {
@@ -393,19 +399,13 @@ def get_projects():
                 "members": [
                     {
                         "employee_id": assignment.employee_id,
-                        "name": User.query.filter_by(employee_id=assignment.employee_id)
-                        .first()
-                        .name,
+                        "name": assignment.user.name,
                     }
-                    for assignment in assignments.query.filter_by(
-                        project_id=project.id
-                    ).all()
+                    for assignment in project.members
                 ],
                 "status": project.status,
-                "start_date": project.start_date.strftime("%Y-%m-%d"),
-                "end_date": (
-                    project.end_date.strftime("%Y-%m-%d") if project.end_date else None
-                ),
+                "start_date": project.start_date,
+                "end_date": project.end_date,
             }
             for project in projects_list
         ]
@@ -492,29 +492,28 @@ def assign_project():
     if not project_id or not employee_id:
         return jsonify({"message": "All fields are required"}), 400
 
-    # Check if the project exists
-    project = projects.query.get(project_id)
-    if not project:
+    # Check that both the project and the user exist in one round trip
+    project_exists, user_exists = db.session.execute(
+        db.select(
+            db.select(projects.id).where(projects.id == project_id).exists(),
+            db.select(User.employee_id).where(User.employee_id == employee_id).exists(),
+        )
+    ).one()
+    if not project_exists:
         return jsonify({"message": "Project not found"}), 404
-
-    # Check if the user exists
-    user_to_assign = User.query.filter_by(employee_id=employee_id).first()
-    if not user_to_assign:
+    if not user_exists:
         return jsonify({"message": "User not found"}), 404
 
-    # Check if the user is already assigned to the project
-    existing_assignment = assignments.query.filter_by(
-        project_id=project_id, employee_id=employee_id
-    ).first()
-    if existing_assignment:
-        return jsonify({"message": "User is already assigned to this project"}), 400
-
-    # Create a new assignment entry in the database
-    new_assignment = assignments(
-        employee_id=employee_id, project_id=project_id, assigned_at=datetime.utcnow()
-    )
+    # Create a new assignment entry; uq_assign_proj_emp on (project_id,
+    # employee_id) rejects duplicates, so there is no separate pre-check
+    new_assignment = assignments(employee_id=employee_id, project_id=project_id)
     db.session.add(new_assignment)
-    db.session.commit()
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({"message": "User is already assigned to this project"}), 400
+    invalidate_project_access(employee_id, project_id)
 
     return jsonify({"message": "User assigned to project successfully"}), 201
 
@@ -550,18 +549,7 @@ def assign_project():
             }
         ],
         "responses": {
-            200: {
-                "description": "User removed from project successfully.",
-                "schema": {
-                    "type": "object",
-                    "properties": {
-                        "message": {
-                            "type": "string",
-                            "example": "Assignment removed successfully",
-                        }
-                    },
-                },
-            },
+            204: {"description": "User removed from project successfully."},
             400: {
                 "description": "Bad request.",
                 "schema": {
@@ -598,18 +586,16 @@ def remove_assignment():
     if not project_id or not employee_id:
         return jsonify({"message": "All fields are required"}), 400
 
-    # Check if the assignment exists
-    assignment = assignments.query.filter_by(
+    # Delete directly; a zero row count means the assignment didn't exist
+    deleted = assignments.query.filter_by(
         project_id=project_id, employee_id=employee_id
-    ).first()
-    if not assignment:
-        return jsonify({"message": "Assignment not found"}), 404
-
-    # Remove the assignment from the database
-    db.session.delete(assignment)
+    ).delete(synchronize_session=False)
     db.session.commit()
+    if not deleted:
+        return jsonify({"message": "Assignment not found"}), 404
+    invalidate_project_access(employee_id, project_id)
 
-    return jsonify({"message": "Assignment removed successfully"}), 200
+    return "", 204
 
 
 @project_bp.route("/archive-project/<int:project_id>", methods=["POST"])
@@ -630,18 +616,7 @@ def remove_assignment():
             }
         ],
         "responses": {
-            200: {
-                "description": "Project archived successfully.",
-                "schema": {
-                    "type": "object",
-                    "properties": {
-                        "message": {
-                            "type": "string",
-                            "example": "Project archived successfully",
-                        }
-                    },
-                },
-            },
+            204: {"description": "Project archived successfully."},
             404: {
                 "description": "Project not found.",
                 "schema": {
@@ -658,13 +633,12 @@ def remove_assignment():
     }
 )
 def archive_project(project_id):
-    # Get the project to archive
-    project = projects.query.get(project_id)
-    if not project:
-        return jsonify({"message": "Project not found"}), 404
-
-    # Archive the project (you can implement your own archiving logic here)
-    project.archived = True
+    # Archive with a single UPDATE; a zero row count means no such project
+    updated = projects.query.filter_by(id=project_id).update(
+        {"archived": True}, synchronize_session=False
+    )
     db.session.commit()
+    if not updated:
+        return jsonify({"message": "Project not found"}), 404
 
-    return jsonify({"message": "Project archived successfully"}), 200
+    return "", 204
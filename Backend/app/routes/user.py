@@ -1,10 +1,10 @@
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, request, jsonify, current_app, send_from_directory, url_for
 from werkzeug.utils import secure_filename
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from app import db
-from app.models import User
+from app import db, cache_region
+from app.models import User, role_list_cache_key
 import os
-from app.utils.auth_utils import roles_required
+from app.utils.auth_utils import roles_required, get_user_cached
 
 import uuid
 from flasgger import swag_from
@@ -12,6 +12,34 @@ from flasgger import swag_from
 user_bp = Blueprint("user", __name__)
 
 
+def _users_with_role(role):
+    """Returns the users with a role, cached until any user row changes."""
+
+    def load():
+        # Plain rows of the three listed columns; no ORM instances are hydrated
+        rows = db.session.query(User.employee_id, User.name, User.email).filter_by(
+            role=role
+        )
+        return [row._asdict() for row in rows]
+
+    return cache_region.get_or_create(role_list_cache_key(role), load)
+
+
+def _profile_pictures_dir():
+    return os.path.abspath(
+        os.path.join(current_app.config.get("UPLOADS_DIR"), "profile_pictures")
+    )
+
+
+def _profile_picture_url(profile_picture):
+    """URL the picture is served from; older rows hold a full server path."""
+    if not profile_picture:
+        return None
+    return url_for(
+        "user.get_profile_picture", filename=os.path.basename(profile_picture)
+    )
+
+
 @user_bp.route("/get-profile", methods=["GET"])
 @jwt_required()
 @swag_from(
@@ -40,7 +68,7 @@ user_bp = Blueprint("user", __name__)
 )
 def get_profile():
     current_user_id = get_jwt_identity()
-    user = User.query.filter_by(employee_id=current_user_id).first()
+    user = get_user_cached(current_user_id)
 
     if not user:
         return jsonify({"error": "User not found"}), 404
@@ -52,7 +80,7 @@ def get_profile():
                 "name": user.name,
                 "email": user.email,
                 "role": user.role,
-                "profile_picture": user.profile_picture,
+                "profile_picture": _profile_picture_url(user.profile_picture),
             }
         ),
         200,
@@ -77,50 +105,68 @@ def get_profile():
     }
 )
 def update_profile():
+    # Reject an empty file part before touching the DB
+    file = request.files.get("profile_picture")
+    if file is not None and not file.filename:
+        return jsonify({"error": "No file uploaded"}), 400
+
     current_user_id = get_jwt_identity()
-    user = User.query.filter_by(employee_id=current_user_id).first()
+    user = get_user_cached(current_user_id)
 
     if not user:
         return jsonify({"error": "User not found"}), 404
 
-    data = request.form
-    if "profile_picture" in request.files:
-        uploads_dir = os.path.join(
-            current_app.config.get("UPLOADS_DIR"), "profile_pictures"
-        )
+    if file is not None:
+        uploads_dir = _profile_pictures_dir()
         os.makedirs(uploads_dir, exist_ok=True)
 
-        file = request.files["profile_picture"]
-        if file.filename:
-            filename = secure_filename(
-                f"{uuid.uuid4().hex}{os.path.splitext(file.filename)[1]}"
-            )
-
-            filepath = os.path.join(
-                current_app.config.get("UPLOADS_DIR"), "profile_pictures", filename
-            )
-            file.save(filepath)
-            user.profile_picture = filepath
-            db.session.commit()
-        else:
-            return jsonify({"error": "No file uploaded"}), 400
+        filename = secure_filename(
+            f"{uuid.uuid4().hex}{os.path.splitext(file.filename)[1]}"
+        )
+        file.save(
+            os.path.join(uploads_dir, filename),
+            buffer_size=current_app.config["UPLOAD_COPY_BUFFER"],
+        )
+        # Only the name is stored; the URL is built when responding
+        user.profile_picture = filename
+
+    user_data = {
+        "employee_id": user.employee_id,
+        "name": user.name,
+        "email": user.email,
+        "profile_picture": _profile_picture_url(user.profile_picture),
+    }
+    if db.session.is_modified(user):
+        db.session.commit()
 
     return (
-        jsonify(
-            {
-                "message": "Profile updated successfully",
-                "user": {
-                    "employee_id": user.employee_id,
-                    "name": user.name,
-                    "email": user.email,
-                    "profile_picture": user.profile_picture,
-                },
-            }
-        ),
+        jsonify({"message": "Profile updated successfully", "user": user_data}),
         200,
     )
 
 
+@user_bp.route("/profile-picture/<filename>", methods=["GET"])
+@jwt_required()
+@swag_from(
+    {
+        "tags": ["User"],
+        "description": "Get a profile picture",
+        "security": [{"BearerAuth": []}],
+        "parameters": [
+            {"name": "filename", "in": "path", "type": "string", "required": True},
+        ],
+        "responses": {
+            200: {"description": "The image file"},
+            404: {"description": "Picture not found"},
+        },
+    }
+)
+def get_profile_picture(filename):
+    # send_from_directory rejects names that escape the directory; with
+    # USE_X_SENDFILE set, the web server sends the bytes
+    return send_from_directory(_profile_pictures_dir(), filename)
+
+
 @user_bp.route("/get-all-testers", methods=["GET"])
 @roles_required("admin", "manager")
 @swag_from(
@@ -147,22 +193,11 @@ def update_profile():
     }
 )
 def get_all_testers():
-    current_user_id = get_jwt_identity()
-    user = User.query.filter_by(employee_id=current_user_id).first()
+    tester_list = _users_with_role("tester")
 
-    if not user:
-        return jsonify({"error": "User not found"}), 404
-
-    testers = User.query.filter_by(role="tester").all()
-
-    if not testers:
+    if not tester_list:
         return jsonify({"message": "No testers found"}), 404
 
-    tester_list = [
-        {"employee_id": tester.employee_id, "name": tester.name, "email": tester.email}
-        for tester in testers
-    ]
-
     return jsonify(tester_list), 200
 
 
@@ -192,24 +227,9 @@ def get_all_testers():
     }
 )
 def get_all_managers():
-    current_user_id = get_jwt_identity()
-    user = User.query.filter_by(employee_id=current_user_id).first()
+    manager_list = _users_with_role("manager")
 
-    if not user:
-        return jsonify({"error": "User not found"}), 404
-
-    managers = User.query.filter_by(role="manager").all()
-
-    if not managers:
+    if not manager_list:
         return jsonify({"message": "No managers found"}), 404
 
-    manager_list = [
-        {
-            "employee_id": manager.employee_id,
-            "name": manager.name,
-            "email": manager.email,
-        }
-        for manager in managers
-    ]
-
     return jsonify(manager_list), 200
@@ -1,10 +1,12 @@
 from flask import Blueprint, request, jsonify
 from werkzeug.utils import secure_filename
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from app.models import User
+from sqlalchemy import select
+from app.models import db, User
 from flasgger import swag_from
 from app.utils.auth_utils import roles_required
 from app.utils.vm_utils import (
+    VALID_INSTANCE_OS,
     start_vm_util,
     stop_vm_util,
     vm_status_util,
@@ -49,22 +51,19 @@ vm_bp = Blueprint("vm", __name__)
                 },
             },
             400: {"description": "Bad request"},
-            404: {"description": "User not found"},
+            404: {"description": "User doesn't have any VMs"},
             500: {"description": "Internal server error"},
         },
     }
 )
 def start_vm():
     current_user_id = get_jwt_identity()
-    user = User.query.filter_by(employee_id=current_user_id).first()
-    if not user:
-        return jsonify({"error": "User not found"}), 404
 
-    instance_os = request.form.get("instance_os", None).lower()
+    instance_os = request.form.get("instance_os", "").lower()
     if not instance_os:
         return jsonify({"error": "Instance os is required"}), 400
 
-    if instance_os not in ["linux", "windows"]:
+    if instance_os not in VALID_INSTANCE_OS:
         return jsonify({"error": "Invalid instance os"}), 400
 
     return start_vm_util(current_user_id, instance_os)
@@ -96,22 +95,19 @@ def start_vm():
                 },
             },
             400: {"description": "Bad request"},
-            404: {"description": "User not found"},
+            404: {"description": "User doesn't have any VMs"},
             500: {"description": "Internal server error"},
         },
     }
 )
 def stop_vm():
     current_user_id = get_jwt_identity()
-    user = User.query.filter_by(employee_id=current_user_id).first()
-    if not user:
-        return jsonify({"error": "User not found"}), 404
 
-    instance_os = request.form.get("instance_os", None).lower()
+    instance_os = request.form.get("instance_os", "").lower()
     if not instance_os:
         return jsonify({"error": "Instance os is required"}), 400
 
-    if instance_os not in ["linux", "windows"]:
+    if instance_os not in VALID_INSTANCE_OS:
         return jsonify({"error": "Invalid instance os"}), 400
 
     return stop_vm_util(current_user_id, instance_os)
@@ -143,22 +139,19 @@ def stop_vm():
                 },
             },
             400: {"description": "Bad request"},
-            404: {"description": "User not found"},
+            404: {"description": "User doesn't have any VMs"},
             500: {"description": "Internal server error"},
         },
     }
 )
 def restart_vm():
     current_user_id = get_jwt_identity()
-    user = User.query.filter_by(employee_id=current_user_id).first()
-    if not user:
-        return jsonify({"error": "User not found"}), 404
 
-    instance_os = request.form.get("instance_os", None).lower()
+    instance_os = request.form.get("instance_os", "").lower()
     if not instance_os:
         return jsonify({"error": "Instance os is required"}), 400
 
-    if instance_os not in ["linux", "windows"]:
+    if instance_os not in VALID_INSTANCE_OS:
         return jsonify({"error": "Invalid instance os"}), 400
 
     return restart_vm_util(current_user_id, instance_os)
@@ -189,17 +182,12 @@ def restart_vm():
                     },
                 },
             },
-            404: {"description": "User not found"},
             500: {"description": "Internal server error"},
         },
     }
 )
 def get_status():
     current_user_id = get_jwt_identity()
-    user = User.query.filter_by(employee_id=current_user_id).first()
-
-    if not user:
-        return jsonify({"error": "User not found"}), 404
     return vm_status_util(current_user_id)
 
 
@@ -231,7 +219,7 @@ def get_status():
                     },
                 },
             },
-            404: {"description": "User not found"},
+            404: {"description": "User doesn't have any VMs"},
             500: {"description": "Internal server error"},
         },
     }
@@ -241,30 +229,20 @@ def get_vms():
     try:
         from app.models import vms as VMs
 
+        # roles_required has already checked that the user exists
         current_user_id = get_jwt_identity()
 
-        # First check if user exists
-        user = User.query.filter_by(employee_id=current_user_id).first()
-        if not user:
-            return jsonify({"error": "User not found"}), 404
-
-        # Query VMs directly from the VMs model using the employee_id
-        user_vms = VMs.query.filter_by(employee_id=current_user_id).all()
+        # Only the four reported columns; rows need no ORM identity tracking
+        rows = db.session.execute(
+            select(
+                VMs.instance_id, VMs.instance_os, VMs.guacamole_url, VMs.status
+            ).where(VMs.employee_id == current_user_id)
+        ).all()
 
-        if not user_vms:
+        if not rows:
             return jsonify({"error": "User doesn't have any VMs"}), 404
 
-        # Format the result
-        vm_list = []
-        for vm in user_vms:
-            vm_list.append(
-                {
-                    "instance_id": vm.instance_id,
-                    "instance_os": vm.instance_os,
-                    "guacamole_url": vm.guacamole_url,
-                    "status": vm.status,
-                }
-            )
+        vm_list = [row._asdict() for row in rows]
 
         return jsonify({"vms": vm_list}), 200
 
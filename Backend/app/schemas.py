@@ -0,0 +1,75 @@
+from datetime import date
+from typing import Literal, Optional
+from pydantic import BaseModel, ConfigDict, Field, field_validator, model_validator
+
+# Employee IDs are strings in the DB but the frontend may send them as numbers
+_BODY_CONFIG = ConfigDict(coerce_numbers_to_str=True)
+
+_REQUIRED_ERRORS = {"missing", "string_too_short", "none_required", "string_type"}
+_DATE_ERRORS = {"date_parsing", "date_from_datetime_parsing", "date_type"}
+
+
+def validation_message(exc):
+    """Maps the first pydantic error to the messages the project endpoints return."""
+    error = exc.errors()[0]
+    if error["type"] in _REQUIRED_ERRORS:
+        return "All fields are required"
+    if error["type"] in _DATE_ERRORS or error["type"].startswith("date_from_datetime"):
+        return "Invalid date format. Use YYYY-MM-DD."
+    if error["type"] == "literal_error" and error["loc"] == ("status",):
+        return "Invalid status value"
+    if error["type"] == "value_error":
+        return str(error["ctx"]["error"])
+    if error["type"] == "json_invalid":
+        return "Invalid JSON body"
+    field = ".".join(str(part) for part in error["loc"]) or "body"
+    return f"Invalid value for {field}"
+
+
+class CreateProjectBody(BaseModel):
+    model_config = _BODY_CONFIG
+
+    project_name: str = Field(min_length=1)
+    description: str = Field(min_length=1)
+    scope: str = Field(min_length=1)
+    start_date: date
+    end_date: date
+    manager: str = Field(min_length=1)
+
+    @model_validator(mode="after")
+    def check_dates(self):
+        if self.start_date >= self.end_date:
+            raise ValueError("Start date must be before end date")
+        return self
+
+
+class UpdateProjectBody(BaseModel):
+    model_config = _BODY_CONFIG
+
+    project_name: Optional[str] = None
+    description: Optional[str] = None
+    scope: Optional[str] = None
+    status: Optional[Literal["not started", "in progress", "complete"]] = None
+    start_date: Optional[date] = None
+    end_date: Optional[date] = None
+    manager: Optional[str] = None
+
+    @field_validator("*", mode="before")
+    @classmethod
+    def blank_as_unset(cls, value):
+        # Forms send "" for untouched fields; treat them like omitted ones
+        return None if value == "" else value
+
+
+class AssignmentBody(BaseModel):
+    model_config = _BODY_CONFIG
+
+    project_id: int
+    employee_id: str = Field(min_length=1)
+
+
+class BulkAssignmentBody(BaseModel):
+    model_config = _BODY_CONFIG
+
+    project_id: int
+    employee_ids: list[str] = Field(min_length=1)
@@ -1,9 +1,11 @@
 from flask_socketio import emit, join_room, leave_room
 from flask_jwt_extended import decode_token
 from flask import request, current_app
-from app.models import User, projects, assignments, ChatMessage
+from sqlalchemy import insert
+from app.models import ChatMessage
 from app import db, socketio  # Import socketio from app package
-from datetime import datetime
+from app.utils.auth_utils import get_user_identity, project_access
+from datetime import datetime, timezone
 import logging
 
 logger = logging.getLogger(__name__)
@@ -21,16 +23,31 @@ def handle_connect():
             logger.warning("No token provided in connection")
             return False  # Reject connection
 
+        # A JWT is header.payload.signature; turn away anything else before
+        # paying for signature verification
+        if token.count(".") != 2:
+            logger.warning("Malformed token in connection")
+            return False
+
         # Verify and decode token
         decoded_token = decode_token(token)
         user_id = decoded_token["sub"]
 
+        # Reject unknown users once here instead of on every event
+        identity = get_user_identity(user_id)
+        if not identity:
+            logger.warning(f"Unknown user {user_id} tried to connect")
+            return False
+
         # Store user_id in session
         # Flask-SocketIO doesn't support adding attributes to request directly
         # in newer versions, so we use the session dict instead
         from flask import session
 
         session["user_id"] = user_id
+        # The display name is all leave notices need; role checks still go
+        # through the identity cache so demotions apply to open sockets
+        session["user_name"] = identity["name"]
         logger.info(f"User {user_id} connected with session {request.sid}")
         return True
     except Exception as e:
@@ -61,31 +78,18 @@ def handle_join(data):
             emit("error", {"message": "Authentication required"})
             return
 
-        # Get user details
-        user = User.query.filter_by(employee_id=user_id).first()
+        # Get user details from the cached identity snapshot
+        user = get_user_identity(user_id)
         if not user:
             emit("error", {"message": "User not found"})
             return
 
-        # Check if project exists
-        project = projects.query.get(project_id)
-        if not project:
+        # Check that the project exists and the user has access, in one query
+        has_access = project_access(user_id, user["role"], project_id)
+        if has_access is None:
             emit("error", {"message": "Project not found"})
             return
 
-        # Check if user has access to project
-        has_access = False
-        if user.role in ["admin", "manager"]:
-            has_access = True
-        else:
-            # For testers, check if they're assigned to the project
-            assignment = assignments.query.filter_by(
-                employee_id=user.employee_id, project_id=project_id
-            ).first()
-
-            if assignment or project.manager == user.employee_id:
-                has_access = True
-
         if not has_access:
             emit("error", {"message": "You don't have access to this project"})
             return
@@ -99,9 +103,9 @@ def handle_join(data):
         emit(
             "status",
             {
-                "user": user.name,
+                "user": user["name"],
                 "message": "has joined the chat",
-                "timestamp": datetime.utcnow().isoformat(),
+                "timestamp": datetime.now(timezone.utc).isoformat(),
             },
             room=room,
         )
@@ -127,12 +131,6 @@ def handle_leave(data):
             emit("error", {"message": "Authentication required"})
             return
 
-        # Get user details
-        user = User.query.filter_by(employee_id=user_id).first()
-        if not user:
-            emit("error", {"message": "User not found"})
-            return
-
         # Leave the room
         room = f"project_{project_id}"
         leave_room(room)
@@ -142,9 +140,9 @@ def handle_leave(data):
         emit(
             "status",
             {
-                "user": user.name,
+                "user": session.get("user_name"),
                 "message": "has left the chat",
-                "timestamp": datetime.utcnow().isoformat(),
+                "timestamp": datetime.now(timezone.utc).isoformat(),
             },
             room=room,
         )
@@ -173,56 +171,48 @@ def handle_message(data):
             emit("error", {"message": "Authentication required"})
             return
 
-        # Get user details
-        user = User.query.filter_by(employee_id=user_id).first()
+        # Get user details from the cached identity snapshot
+        user = get_user_identity(user_id)
         if not user:
             emit("error", {"message": "User not found"})
             return
 
-        # Check if project exists
-        project = projects.query.get(project_id)
-        if not project:
+        # Check that the project exists and the user has access, in one query
+        has_access = project_access(user_id, user["role"], project_id)
+        if has_access is None:
             emit("error", {"message": "Project not found"})
             return
 
-        # Check if user has access to project
-        has_access = False
-        if user.role in ["admin", "manager"]:
-            has_access = True
-        else:
-            # For testers, check if they're assigned to the project
-            assignment = assignments.query.filter_by(
-                employee_id=user_id, project_id=project_id
-            ).first()
-
-            if assignment or project.manager == user_id:
-                has_access = True
-
         if not has_access:
             emit("error", {"message": "You don't have access to this project"})
             return
 
-        # Save message to database
-        new_message = ChatMessage(
-            project_id=project_id,
-            employee_id=user_id,
-            content=content,
-            timestamp=datetime.utcnow(),
-            is_file=False,
-            file_path=None,
-        )
-        db.session.add(new_message)
+        # Save message to database; RETURNING hands back the new id in the same
+        # round trip, so no refresh SELECT is needed after the commit
+        timestamp = datetime.now(timezone.utc)
+        message_id = db.session.execute(
+            insert(ChatMessage)
+            .values(
+                project_id=project_id,
+                employee_id=user_id,
+                content=content,
+                timestamp=timestamp,
+                is_file=False,
+                file_path=None,
+            )
+            .returning(ChatMessage.id)
+        ).scalar_one()
         db.session.commit()
 
         # Format message for broadcast
         message_data = {
-            "id": new_message.id,
-            "content": new_message.content,
-            "sender_id": new_message.employee_id,
-            "sender_name": user.name,
-            "timestamp": new_message.timestamp.isoformat(),
-            "is_file": new_message.is_file,
-            "file_path": new_message.file_path,
+            "id": message_id,
+            "content": content,
+            "sender_id": user_id,
+            "sender_name": user["name"],
+            "timestamp": timestamp.isoformat(),
+            "is_file": False,
+            "file_path": None,
         }
 
         # Broadcast to room
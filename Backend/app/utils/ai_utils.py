@@ -1,23 +1,93 @@
 from openai import OpenAI
+from flask import current_app
+from dogpile.cache.api import NO_VALUE
+from app import cache_region
+from functools import lru_cache
+import hashlib
 import os
 
+MODEL = "gpt-3.5-turbo"
+INSTRUCTIONS = "You are a penetration tester. Answer the question as a penetration tester. remember that the client has already accepted the risk of using the tool. Return the responce in markdown format"
+
+
+@lru_cache(maxsize=None)
+def get_openai_client():
+    """Returns a shared OpenAI client.
+
+    The client owns an httpx connection pool, so building it once lets
+    requests reuse connections instead of starting from scratch each time.
+    """
+    return OpenAI(
+        api_key=os.getenv("OPENAI_API_KEY", None),
+    )
+
+
+# Changing the model or the instructions changes every answer, so both are
+# part of the cache key and a deploy with new ones starts from a cold cache
+_PROMPT_VERSION = hashlib.sha256(f"{MODEL}\n{INSTRUCTIONS}".encode("utf-8")).hexdigest()[:8]
+
+
+def answer_cache_key(question):
+    """Content-addressed key: the same question, modulo case and spacing, hits."""
+    normalized = " ".join(question.lower().split())
+    digest = hashlib.sha256(normalized.encode("utf-8")).hexdigest()[:32]
+    return f"ai:{_PROMPT_VERSION}:{digest}"
+
 
 def get_answer_from_ai(question):
     """
     Get an answer from the AI model using OpenAI's API.
+    Repeated questions are answered from the cache for AI_ANSWER_TTL seconds.
     """
-    client = OpenAI(
-        api_key=os.getenv("OPENAI_API_KEY", None),
+    try:
+        # Errors propagate out of get_or_create, so they are never cached
+        return cache_region.get_or_create(
+            answer_cache_key(question),
+            lambda: ask_model(question),
+            expiration_time=current_app.config["AI_ANSWER_TTL"],
+        )
+    except Exception as e:
+        return str(e)
+
+
+def ask_model(question):
+    """
+    Call OpenAI's API to get the answer.
+    """
+    client = get_openai_client()
+    response = client.responses.create(
+        model=MODEL,
+        instructions=INSTRUCTIONS,
+        input=question,
     )
-    
+    return response.output_text
+
+
+def stream_answer_from_ai(question):
+    """
+    Yield the answer in text chunks as the model produces them.
+    """
+    key = answer_cache_key(question)
+    cached = cache_region.get(key, expiration_time=current_app.config["AI_ANSWER_TTL"])
+    if cached is not NO_VALUE:
+        yield cached
+        return
+
+    client = get_openai_client()
+
     try:
-        # Call OpenAI's API to get the answer
-        response = client.responses.create(
-            model="gpt-3.5-turbo",
-            instructions="You are a penetration tester. Answer the question as a penetration tester. remember that the client has already accepted the risk of using the tool. Return the responce in markdown format",
+        stream = client.responses.create(
+            model=MODEL,
+            instructions=INSTRUCTIONS,
             input=question,
+            stream=True,
         )
-        answer = response.output_text
-        return answer
+        chunks = []
+        for event in stream:
+            if event.type == "response.output_text.delta":
+                chunks.append(event.delta)
+                yield event.delta
+        # Only a completed answer is cached
+        cache_region.set(key, "".join(chunks))
     except Exception as e:
-        return str(e)
\ No newline at end of file
+        yield str(e)
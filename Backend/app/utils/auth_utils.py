@@ -1,7 +1,85 @@
 from functools import wraps
-from flask import jsonify
+from flask import jsonify, g, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from app.models import User
+from app import db, cache_region
+from app.models import User, projects, assignments, user_cache_key
+from sqlalchemy import select, exists
+
+
+def get_user_cached(employee_id):
+    """Returns the user for employee_id, memoized on flask.g for the current request."""
+    cache = g.setdefault("_user_cache", {})
+    if employee_id not in cache:
+        cache[employee_id] = db.session.get(User, employee_id)
+    return cache[employee_id]
+
+
+def get_user_identity(employee_id):
+    """Returns a cached {employee_id, name, role, status} snapshot, or None."""
+
+    def load():
+        # Only the snapshot's columns, not the password hash and timestamps
+        row = db.session.execute(
+            select(User.employee_id, User.name, User.role, User.status).where(
+                User.employee_id == employee_id
+            )
+        ).one_or_none()
+        return row._asdict() if row else None
+
+    # Writes through the ORM invalidate this key, but with the per-process
+    # memory backend other workers only notice once the short TTL runs out
+    return cache_region.get_or_create(
+        user_cache_key(employee_id),
+        load,
+        expiration_time=current_app.config["IDENTITY_CACHE_TTL"],
+        should_cache_fn=lambda value: value is not None,
+    )
+
+
+def project_access_cache_key(employee_id, project_id):
+    return f"access:{employee_id}:{project_id}"
+
+
+def invalidate_project_access(employee_id, project_id):
+    """Drops a cached access decision; call after assignment or manager changes."""
+    cache_region.delete(project_access_cache_key(employee_id, project_id))
+
+
+def project_access(employee_id, role, project_id):
+    """Returns None if the project doesn't exist, else whether the user may use it.
+
+    Admins and managers see every project; others need to manage it or be
+    assigned to it. The project and assignment lookups share one query, and
+    its outcome is cached for ACCESS_CACHE_TTL seconds so chat polling
+    doesn't repeat it.
+    """
+
+    def load():
+        row = db.session.execute(
+            select(
+                projects.manager,
+                exists()
+                .where(
+                    assignments.employee_id == employee_id,
+                    assignments.project_id == project_id,
+                )
+                .label("assigned"),
+            ).where(projects.id == project_id)
+        ).first()
+        if row is None:
+            return None
+        return {"member": bool(row.assigned) or row.manager == employee_id}
+
+    # Missing projects aren't cached, so a newly created one is seen at once
+    decision = cache_region.get_or_create(
+        project_access_cache_key(employee_id, project_id),
+        load,
+        expiration_time=current_app.config["ACCESS_CACHE_TTL"],
+        should_cache_fn=lambda value: value is not None,
+    )
+    if decision is None:
+        return None
+    return role in ("admin", "manager") or decision["member"]
 
 
 def roles_required(*required_roles):
@@ -12,13 +90,37 @@ def roles_required(*required_roles):
         @jwt_required()
         def wrapper(*args, **kwargs):
             current_user_id = get_jwt_identity()
-            user = User.query.filter_by(employee_id=current_user_id).first()
+            identity = get_user_identity(current_user_id)
 
-            if not user or user.role.lower() not in required_roles:
+            if not identity or identity["role"].lower() not in required_roles:
                 return jsonify({"error": "Unauthorized"}), 403
 
+            # Handlers read the role from here instead of reloading the user
+            g.identity = identity
             return fn(*args, **kwargs)
 
         return wrapper
 
     return decorator
+
+
+def project_access_required(fn):
+    """Decorator that 404s/403s unless the caller may use the route's project.
+
+    Goes below roles_required, which loads g.identity; the project comes from
+    the ``project_id`` URL argument.
+    """
+
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        identity = g.identity
+        access = project_access(
+            identity["employee_id"], identity["role"], kwargs["project_id"]
+        )
+        if access is None:
+            return jsonify({"error": "Project not found"}), 404
+        if not access:
+            return jsonify({"error": "User does not have access to this project"}), 403
+        return fn(*args, **kwargs)
+
+    return wrapper
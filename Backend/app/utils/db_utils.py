@@ -0,0 +1,43 @@
+from flask import g, has_app_context, current_app, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import raiseload
+
+
+def dev_raiseload(*options):
+    """Returns the loader options, plus raiseload("*") in debug/testing.
+
+    Any relationship the options don't load then fails loudly in development
+    instead of quietly going N+1; production keeps ordinary lazy loading.
+    """
+    if current_app.debug or current_app.testing:
+        return (*options, raiseload("*"))
+    return options
+
+
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    if has_app_context():
+        g.query_count = g.get("query_count", 0) + 1
+
+
+def init_query_counter(app):
+    """Counts SQL statements per request and reports them in dev.
+
+    Every response gets an X-Query-Count header, and a warning is logged
+    when a request runs more than QUERY_COUNT_WARN statements, so N+1
+    regressions show up while clicking through the UI. Queries run while a
+    streamed body is being generated are not included.
+    """
+
+    # The listener is on the Engine class and shared by every app; registering
+    # it once keeps a second create_app() from counting each query twice
+    if not event.contains(Engine, "before_cursor_execute", _count_query):
+        event.listen(Engine, "before_cursor_execute", _count_query)
+
+    @app.after_request
+    def report_query_count(response):
+        count = g.get("query_count", 0)
+        response.headers["X-Query-Count"] = str(count)
+        if count > current_app.config["QUERY_COUNT_WARN"]:
+            current_app.logger.warning("%s ran %d SQL queries", request.path, count)
+        return response
@@ -0,0 +1,61 @@
+import hashlib
+import orjson
+from flask import current_app, request
+from flask.json.provider import DefaultJSONProvider
+
+
+class OrJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider that parses and serializes with orjson."""
+
+    def dumps(self, obj, **kwargs):
+        # Types orjson can't handle natively fall back to Flask's default hook
+        return orjson.dumps(
+            obj, default=self.default, option=orjson.OPT_NON_STR_KEYS
+        ).decode("utf-8")
+
+    def response(self, *args, **kwargs):
+        # jsonify() goes through here; hand orjson's bytes straight to the
+        # response instead of decoding to str and re-encoding
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+    def loads(self, s, **kwargs):
+        # orjson.JSONDecodeError subclasses ValueError, so request.get_json()
+        # still turns malformed bodies into a 400
+        return orjson.loads(s)
+
+
+class SocketIOJSON:
+    """orjson behind the ``json`` module interface python-socketio expects.
+
+    Every emit to a room is encoded once per packet, so this keeps the chat
+    broadcast path in C. Extra arguments such as ``separators`` are ignored;
+    orjson's output is already compact.
+    """
+
+    @staticmethod
+    def dumps(obj, *args, **kwargs):
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+
+    @staticmethod
+    def loads(s, *args, **kwargs):
+        return orjson.loads(s)
+
+
+def conditional_json(data):
+    """Returns a JSON response tagged with a content ETag, or a 304 if it matches.
+
+    ``data`` may also be JSON that is already encoded to bytes, e.g. built by the DB.
+    """
+    if isinstance(data, bytes):
+        body = data
+    else:
+        body = orjson.dumps(
+            data, default=current_app.json.default, option=orjson.OPT_NON_STR_KEYS
+        )
+    response = current_app.response_class(body, mimetype="application/json")
+    response.set_etag(hashlib.blake2b(body, digest_size=16).hexdigest())
+    # Let browsers keep a copy but revalidate it with If-None-Match every time
+    response.headers["Cache-Control"] = "private, max-age=0, must-revalidate"
+    return response.make_conditional(request)
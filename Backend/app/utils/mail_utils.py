@@ -0,0 +1,51 @@
+import smtplib
+import time
+from email.message import EmailMessage
+from flask import current_app
+
+# Attempts per message; the wait doubles after each SMTP failure
+MAIL_MAX_ATTEMPTS = 5
+
+
+def send_email(to, subject, body):
+    """Sends a plain-text email through the configured SMTP server."""
+    config = current_app.config
+    message = EmailMessage()
+    message["From"] = config["MAIL_DEFAULT_SENDER"]
+    message["To"] = to
+    message["Subject"] = subject
+    message.set_content(body)
+
+    with smtplib.SMTP(config["MAIL_SERVER"], config["MAIL_PORT"], timeout=30) as smtp:
+        if config["MAIL_USE_TLS"]:
+            smtp.starttls()
+        if config["MAIL_USERNAME"]:
+            smtp.login(config["MAIL_USERNAME"], config["MAIL_PASSWORD"])
+        smtp.send_message(message)
+
+
+def send_password_reset_email(app, email, reset_link):
+    """Background task: mails a reset link, retrying transient SMTP errors."""
+    with app.app_context():
+        if not app.config["MAIL_SERVER"]:
+            app.logger.warning("MAIL_SERVER is not set; no reset email for %s", email)
+            return
+
+        delay = 1
+        for attempt in range(1, MAIL_MAX_ATTEMPTS + 1):
+            try:
+                send_email(
+                    email,
+                    "Password reset",
+                    f"Use this link to reset your password: {reset_link}\n"
+                    "It expires in 15 minutes.",
+                )
+                return
+            except (smtplib.SMTPException, OSError) as e:
+                app.logger.warning(
+                    "Reset email to %s failed (attempt %d): %s", email, attempt, e
+                )
+                if attempt < MAIL_MAX_ATTEMPTS:
+                    time.sleep(delay)
+                    delay *= 2
+        app.logger.error("Giving up on reset email to %s", email)
@@ -0,0 +1,43 @@
+import boto3
+from functools import lru_cache
+from urllib.parse import quote
+from flask import current_app
+
+# Presigned download links only need to outlive the redirect that hands them out
+DOWNLOAD_URL_EXPIRY = 300
+
+
+@lru_cache(maxsize=None)
+def get_s3_client(region):
+    """Returns a shared S3 client for the region."""
+    return boto3.client("s3", region_name=region)
+
+
+def chat_file_key(project_id, filename):
+    return f"chat_files/{project_id}/{filename}"
+
+
+def upload_chat_file(fileobj, project_id, filename):
+    """Streams an upload to the chat files bucket (multipart for large files)."""
+    s3 = get_s3_client(current_app.config.get("DEFAULT_REGION"))
+    s3.upload_fileobj(
+        fileobj,
+        current_app.config["CHAT_FILES_BUCKET"],
+        chat_file_key(project_id, filename),
+    )
+
+
+def chat_file_download_url(project_id, filename, download_name):
+    """Returns a short-lived URL that downloads the file straight from S3."""
+    s3 = get_s3_client(current_app.config.get("DEFAULT_REGION"))
+    return s3.generate_presigned_url(
+        "get_object",
+        Params={
+            "Bucket": current_app.config["CHAT_FILES_BUCKET"],
+            "Key": chat_file_key(project_id, filename),
+            "ResponseContentDisposition": (
+                f"attachment; filename*=UTF-8''{quote(download_name)}"
+            ),
+        },
+        ExpiresIn=DOWNLOAD_URL_EXPIRY,
+    )
@@ -2,11 +2,47 @@ from flask import request, jsonify
 from werkzeug.utils import secure_filename
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from app.models import db, vms
+from app import cache_region
+from dogpile.cache.api import NO_VALUE
 from flasgger import swag_from
 import boto3, json, hmac, hashlib, base64, requests, time
 from flask import current_app
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from requests.adapters import HTTPAdapter
+from cryptography.hazmat.primitives import padding
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
-from cryptography.hazmat.backends import default_backend
+
+
+# Operating systems a user VM can run; checked on every VM control request
+VALID_INSTANCE_OS = frozenset(("linux", "windows"))
+
+# Keep-alive connections to Guacamole, so minting a token doesn't pay for a
+# new TCP/TLS handshake on every VM start
+_guacamole_session = requests.Session()
+_guacamole_adapter = HTTPAdapter(pool_connections=10, pool_maxsize=20)
+_guacamole_session.mount("http://", _guacamole_adapter)
+_guacamole_session.mount("https://", _guacamole_adapter)
+
+
+@lru_cache(maxsize=None)
+def get_ec2_client(region):
+    """Returns a shared EC2 client for the region.
+
+    Building a client loads the service model and credential chain, so it is
+    done once per region; boto3 clients are safe to share between threads.
+    """
+    return boto3.client("ec2", region_name=region)
+
+
+def instance_private_ip(ec2, vm):
+    """Returns the VM's private IP, asking EC2 only the first time."""
+    if not vm.private_ip:
+        instance_info = ec2.describe_instances(InstanceIds=[vm.instance_id])
+        vm.private_ip = instance_info["Reservations"][0]["Instances"][0][
+            "PrivateIpAddress"
+        ]
+    return vm.private_ip
 
 
 def start_vm_util(user_id, instance_os=None):
@@ -24,16 +60,17 @@ def start_vm_util(user_id, instance_os=None):
     id = vm.instance_id
     default_region = current_app.config.get("DEFAULT_REGION")
 
-    ec2 = boto3.client("ec2", region_name=default_region)
+    ec2 = get_ec2_client(default_region)
 
     try:
-        response = ec2.start_instances(InstanceIds=[id])
-        # Get Instance private IP address
-        instance_info = ec2.describe_instances(InstanceIds=[id])
-        instance_ip = instance_info["Reservations"][0]["Instances"][0][
-            "PrivateIpAddress"
-        ]
-        url = create_guacamole_vnc_connection(user_id, instance_ip)
+        vm_ip = instance_private_ip(ec2, vm)
+        # The start call and the Guacamole token round-trip don't depend on
+        # each other, so they overlap instead of running back to back
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            started = executor.submit(ec2.start_instances, InstanceIds=[id])
+            url = create_guacamole_vnc_connection(user_id, vm_ip)
+            response = started.result()
+        cache_region.delete(instance_state_cache_key(id))
 
         vm.guacamole_url = url
         vm.status = "running"
@@ -59,10 +96,11 @@ def stop_vm_util(user_id, instance_os=None):
     id = vm.instance_id
 
     default_region = current_app.config.get("DEFAULT_REGION")
-    ec2 = boto3.client("ec2", region_name=default_region)
+    ec2 = get_ec2_client(default_region)
 
     try:
         response = ec2.stop_instances(InstanceIds=[id])
+        cache_region.delete(instance_state_cache_key(id))
         vm.status = "stopped"
         db.session.commit()
         return jsonify({"message": "VM stopped successfully"}), 200
@@ -85,16 +123,15 @@ def restart_vm_util(user_id, instance_os=None):
     id = vm.instance_id
     default_region = current_app.config.get("DEFAULT_REGION")
 
-    ec2 = boto3.client("ec2", region_name=default_region)
+    ec2 = get_ec2_client(default_region)
 
     try:
-        response = ec2.reboot_instances(InstanceIds=[id])
-        # Get Instance private IP address
-        instance_info = ec2.describe_instances(InstanceIds=[id])
-        instance_ip = instance_info["Reservations"][0]["Instances"][0][
-            "PrivateIpAddress"
-        ]
-        url = create_guacamole_vnc_connection(user_id, instance_ip)
+        vm_ip = instance_private_ip(ec2, vm)
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            rebooted = executor.submit(ec2.reboot_instances, InstanceIds=[id])
+            url = create_guacamole_vnc_connection(user_id, vm_ip)
+            response = rebooted.result()
+        cache_region.delete(instance_state_cache_key(id))
 
         vm.guacamole_url = url
         db.session.commit()
@@ -108,29 +145,105 @@ def vm_status_util(user_id):
     """Checks the status of a VM for the user."""
 
     user_vms = vms.query.filter_by(employee_id=user_id).all()
+    # An empty InstanceIds list would describe every instance in the account
+    if not user_vms:
+        return jsonify({}), 200
+
     default_region = current_app.config.get("DEFAULT_REGION")
-    ec2 = boto3.client("ec2", region_name=default_region)
+    ec2 = get_ec2_client(default_region)
 
-    result = {}
-    for vm in user_vms:
-        id = vm.instance_id
-        os = vm.instance_os
+    # One call for all of the user's VMs; without IncludeAllInstances only
+    # running instances are listed, so anything missing is reported as stopped
+    try:
+        response = ec2.describe_instance_status(
+            InstanceIds=[vm.instance_id for vm in user_vms]
+        )
+    except Exception as e:
+        return jsonify({"error": "Error getting VM status"}), 500
 
-        try:
-            response = ec2.describe_instance_status(InstanceIds=[id])
-            if response["InstanceStatuses"] == []:
-                result[os] = "Stopped"
-            else:
-                result[os] = response["InstanceStatuses"][0]["InstanceState"]["Name"]
-        except Exception as e:
-            return jsonify({"error": "Error getting VM status"}), 500
+    states = {
+        status["InstanceId"]: status["InstanceState"]["Name"]
+        for status in response["InstanceStatuses"]
+    }
+    result = {
+        vm.instance_os: states.get(vm.instance_id, "Stopped") for vm in user_vms
+    }
 
     return jsonify(result), 200
 
 
-def create_vms(employee_id) -> dict:
-    """Creates VMs for new tester."""
-    ec2 = boto3.client("ec2", region_name=current_app.config.get("DEFAULT_REGION"))
+# describe_instance_status accepts at most 1000 IDs; smaller batches stay well
+# clear of that and of request throttling, and run side by side
+STATUS_BATCH_SIZE = 100
+STATUS_MAX_WORKERS = 8
+
+
+# Reported for instances whose batch EC2 failed to describe, so callers can
+# tell "couldn't check" apart from a real instance state; never cached
+UNKNOWN_STATE = "unknown"
+
+
+def describe_instance_states(ec2, instance_ids) -> dict:
+    """Returns {instance_id: state name}, querying EC2 in concurrent batches.
+
+    IDs in a batch that failed map to UNKNOWN_STATE.
+    """
+    batches = [
+        instance_ids[i : i + STATUS_BATCH_SIZE]
+        for i in range(0, len(instance_ids), STATUS_BATCH_SIZE)
+    ]
+    # The worker threads have no app context of their own
+    logger = current_app.logger
+
+    def describe(batch):
+        try:
+            return ec2.describe_instance_status(
+                InstanceIds=batch, IncludeAllInstances=True
+            ).get("InstanceStatuses", [])
+        except Exception:
+            logger.warning("Error in batch status check", exc_info=True)
+            return None
+
+    states = {}
+    with ThreadPoolExecutor(max_workers=STATUS_MAX_WORKERS) as executor:
+        for batch, statuses in zip(batches, executor.map(describe, batches)):
+            if statuses is None:
+                states.update(dict.fromkeys(batch, UNKNOWN_STATE))
+                continue
+            for instance in statuses:
+                states[instance["InstanceId"]] = instance["InstanceState"]["Name"]
+    return states
+
+
+def instance_state_cache_key(instance_id):
+    """Cache key of the last EC2 state seen for an instance."""
+    return f"ec2:state:{instance_id}"
+
+
+def cached_instance_states(ec2, instance_ids) -> dict:
+    """Like describe_instance_states, but reuses states younger than EC2_STATUS_TTL."""
+    ttl = current_app.config["EC2_STATUS_TTL"]
+    keys = [instance_state_cache_key(iid) for iid in instance_ids]
+    cached = cache_region.get_multi(keys, expiration_time=ttl) if keys else []
+
+    states = {iid: v for iid, v in zip(instance_ids, cached) if v is not NO_VALUE}
+    missing = [iid for iid in instance_ids if iid not in states]
+    if missing:
+        fresh = describe_instance_states(ec2, missing)
+        known = {
+            instance_state_cache_key(iid): state
+            for iid, state in fresh.items()
+            if state != UNKNOWN_STATE
+        }
+        if known:
+            cache_region.set_multi(known)
+        states.update(fresh)
+    return states
+
+
+def create_vms(employee_id, oses=None) -> dict:
+    """Creates VMs for new tester; ``oses`` limits which ones (default: all)."""
+    ec2 = get_ec2_client(current_app.config.get("DEFAULT_REGION"))
 
     vpc_id = current_app.config.get("VPC_ID")
     private_subnet_id = current_app.config.get("PRIVATE_SUBNET_ID")
@@ -144,6 +257,8 @@ def create_vms(employee_id) -> dict:
     instances = {}
 
     for os, image_id in image_ids.items():
+        if oses is not None and os not in oses:
+            continue
         response = ec2.run_instances(
             ImageId=image_id,
             InstanceType=instance_type,
@@ -170,7 +285,63 @@ def create_vms(employee_id) -> dict:
     return instances
 
 
+def missing_vm_oses(employee_id):
+    """Returns the operating systems the user has no VM row for yet."""
+    have = set(
+        db.session.execute(
+            db.select(vms.instance_os).where(vms.employee_id == employee_id)
+        ).scalars()
+    )
+    return sorted(VALID_INSTANCE_OS - have)
+
+
+def provision_user_vms(app, employee_id):
+    """Background task: launches the user's missing VMs and records them.
+
+    Each VM is committed as soon as AWS returns its instance ID, so a failure
+    part way keeps the ones already launched. Running it again (the admin
+    provision-vms route) only launches what is still missing.
+    """
+    with app.app_context():
+        try:
+            for os in missing_vm_oses(employee_id):
+                instance_id = create_vms(employee_id, oses=(os,))[os]
+                db.session.execute(
+                    db.insert(vms).values(
+                        employee_id=employee_id,
+                        instance_id=instance_id,
+                        instance_os=os,
+                        guacamole_url=None,
+                    )
+                )
+                db.session.commit()
+        except Exception:
+            db.session.rollback()
+            app.logger.exception(f"Error provisioning VMs for {employee_id}")
+        finally:
+            db.session.remove()
+
+
+def guacamole_url_cache_key(user_id, vm_ip):
+    """Cache key of the last Guacamole URL minted for a user's VM."""
+    return f"guac:{user_id}:{vm_ip}"
+
+
 def create_guacamole_vnc_connection(user_id, vm_ip):
+    """Returns a Guacamole VNC URL for the VM, reusing a recently minted one.
+
+    Minting signs and encrypts a payload and round-trips to Guacamole, so
+    reopening a VM within GUACAMOLE_TOKEN_TTL gets the same URL back. A
+    failed mint raises and nothing is cached.
+    """
+    return cache_region.get_or_create(
+        guacamole_url_cache_key(user_id, vm_ip),
+        lambda: _mint_guacamole_vnc_connection(user_id, vm_ip),
+        expiration_time=current_app.config["GUACAMOLE_TOKEN_TTL"],
+    )
+
+
+def _mint_guacamole_vnc_connection(user_id, vm_ip):
     # Need to handle the instnace os here
     """Creates a Guacamole VNC connection."""
 
@@ -200,23 +371,18 @@ def create_guacamole_vnc_connection(user_id, vm_ip):
     # Convert JSON payload to bytes
     json_data = json.dumps(payload, separators=(",", ":")).encode("utf-8")
 
-    # Create HMAC-SHA256 signature
-    signature = hmac.new(secret_key, json_data, hashlib.sha256).digest()
+    # Create HMAC-SHA256 signature (one-shot, computed inside OpenSSL)
+    signature = hmac.digest(secret_key, json_data, "sha256")
 
     # Prepend signature to JSON data
     signed_data = signature + json_data
 
-    # Encrypt the signed data using AES-128-CBC
-    cipher = Cipher(
-        algorithms.AES(secret_key), modes.CBC(iv), backend=default_backend()
-    )
-    encryptor = cipher.encryptor()
+    # Pad the signed data to a multiple of 16 bytes (PKCS#7)
+    padder = padding.PKCS7(algorithms.AES.block_size).padder()
+    padded_data = padder.update(signed_data) + padder.finalize()
 
-    # Pad the signed data to a multiple of 16 bytes
-    pad_len = 16 - (len(signed_data) % 16)
-    padded_data = signed_data + bytes([pad_len] * pad_len)
-
-    # Perform encryption
+    # Encrypt the signed data using AES-128-CBC
+    encryptor = Cipher(algorithms.AES(secret_key), modes.CBC(iv)).encryptor()
     encrypted_data = encryptor.update(padded_data) + encryptor.finalize()
 
     # Base64-encode the encrypted data
@@ -225,6 +391,6 @@ def create_guacamole_vnc_connection(user_id, vm_ip):
     url = f"{current_app.config.get('GUACAMOLE_URL')}/api/tokens"
     headers = {"Content-Type": "application/x-www-form-urlencoded"}
     data = {"data": token}
-    response = requests.post(url, headers=headers, data=data)
+    response = _guacamole_session.post(url, headers=headers, data=data)
 
     return f"{current_app.config.get('GUACAMOLE_URL')}/?token={response.json()['authToken']}"
@@ -1,8 +1,21 @@
+from gevent import monkey
+
+# Patch blocking stdlib I/O before anything else imports socket/ssl/threading
+monkey.patch_all()
+
+try:
+    from psycogreen.gevent import patch_psycopg
+except ImportError:  # psycopg2 not installed, e.g. when running on SQLite
+    pass
+else:
+    patch_psycopg()  # let PostgreSQL queries yield to other greenlets
+
 import os
 from flask import Flask
 from flasgger import Swagger
 from dotenv import load_dotenv
-from app import db, migrate, jwt, socketio
+from app import db, migrate, jwt, socketio, cache_region, limiter
+from app.utils.json_utils import OrJSONProvider, SocketIOJSON
 from werkzeug.middleware.proxy_fix import ProxyFix
 import openai
 from flask_cors import CORS
@@ -12,20 +25,75 @@ load_dotenv()
 
 def create_app():
     app = Flask(__name__)
-    CORS(app, origins="*")
+    app.json = OrJSONProvider(app)
+    # Comma-separated, e.g. FRONTEND_ORIGINS=https://app.example.com; "*" if unset.
+    # max_age lets browsers reuse a preflight for a day instead of sending an
+    # OPTIONS request ahead of every cross-origin JSON call
+    cors_origins = [
+        origin.strip()
+        for origin in os.getenv("FRONTEND_ORIGINS", "*").split(",")
+        if origin.strip()
+    ]
+    CORS(app, origins=cors_origins, max_age=86400)
     app.wsgi_app = ProxyFix(app.wsgi_app, x_prefix=1)
+    # Dev-only: QUERY_COUNT_WARN=N adds X-Query-Count and warns above N queries
+    if os.getenv("QUERY_COUNT_WARN"):
+        from app.utils.db_utils import init_query_counter
+
+        app.config["QUERY_COUNT_WARN"] = int(os.getenv("QUERY_COUNT_WARN"))
+        init_query_counter(app)
+    # Dev-only: PROFILE=1 writes a cProfile dump per request (view with snakeviz)
+    if os.getenv("PROFILE"):
+        from werkzeug.middleware.profiler import ProfilerMiddleware
+
+        profile_dir = os.getenv("PROFILE_DIR", "profiles")
+        os.makedirs(profile_dir, exist_ok=True)
+        app.wsgi_app = ProfilerMiddleware(
+            app.wsgi_app, restrictions=[30], profile_dir=profile_dir
+        )
     # DB Configuration
     app.config["SQLALCHEMY_DATABASE_URI"] = os.getenv(
         "DATABASE_URL", "sqlite:///collabsec.db"
     )
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    # Size the pool for concurrent SocketIO/REST greenlets; LIFO keeps warm connections in use
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+        "pool_size": int(os.getenv("DB_POOL_SIZE", 20)),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", 40)),
+        # Pre-ping costs a SELECT 1 per checkout; with the keepalives below it
+        # can be turned off where the network doesn't drop idle connections
+        "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "true").lower() == "true",
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", 1800)),
+        "pool_use_lifo": True,
+    }
+    if app.config["SQLALCHEMY_DATABASE_URI"].startswith("postgresql"):
+        # TCP keepalives stop firewalls/NAT (or PgBouncer) from silently
+        # closing pooled connections while they sit idle
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"]["connect_args"] = {
+            "keepalives": 1,
+            "keepalives_idle": 60,
+            "keepalives_interval": 10,
+            "keepalives_count": 5,
+        }
 
     app.config["UPLOADS_DIR"] = os.getenv("UPLOADS_DIR", "uploads")
+    # Chunk size for copying uploads to disk (Werkzeug's default is 16 KiB)
+    app.config["UPLOAD_COPY_BUFFER"] = int(os.getenv("UPLOAD_COPY_BUFFER", 1 << 20))
+    # Let the web server send chat attachments after Flask checks access:
+    # Apache/lighttpd via X-Sendfile, or nginx via an internal location, e.g.
+    #   location /_protected/ { internal; alias /path/to/uploads/; }
+    app.config["USE_X_SENDFILE"] = os.getenv("USE_X_SENDFILE", "").lower() == "true"
+    app.config["X_ACCEL_REDIRECT_PREFIX"] = os.getenv("X_ACCEL_REDIRECT_PREFIX")
+    # When set, chat attachments live in this S3 bucket instead of UPLOADS_DIR
+    app.config["CHAT_FILES_BUCKET"] = os.getenv("CHAT_FILES_BUCKET")
     # Guacamole Configuration
     app.config["GUACAMOLE_URL"] = os.getenv("GUACAMOLE_URL", "http://localhost:8080")
     app.config["GUACAMOLE_SECRET_HEX_KEY"] = os.getenv(
         "GUACAMOLE_SECRET_HEX_KEY", "91ef08840af07d00919a7b90ebde4107"
     )
+    # Seconds a minted Guacamole URL is handed out again; keep it below
+    # Guacamole's session timeout (60 minutes idle by default)
+    app.config["GUACAMOLE_TOKEN_TTL"] = int(os.getenv("GUACAMOLE_TOKEN_TTL", 1800))
     # AWS EC2 Configuration
     app.config["DEFAULT_REGION"] = os.getenv("DEFAULT_REGION", "me-south-1")
     app.config["VPC_ID"] = os.getenv("VPC_ID", "vpc-06f066366f69a440c")
@@ -40,42 +108,88 @@ def create_app():
     app.config["WINDOWS_IMAGE_ID"] = os.getenv(
         "WINDOWS_IMAGE_ID", "ami-021bf1512473ff5ba"
     )
+    # Mail Configuration (reset links are only logged while MAIL_SERVER is unset)
+    app.config["MAIL_SERVER"] = os.getenv("MAIL_SERVER")
+    app.config["MAIL_PORT"] = int(os.getenv("MAIL_PORT", 587))
+    app.config["MAIL_USE_TLS"] = os.getenv("MAIL_USE_TLS", "true").lower() == "true"
+    app.config["MAIL_USERNAME"] = os.getenv("MAIL_USERNAME")
+    app.config["MAIL_PASSWORD"] = os.getenv("MAIL_PASSWORD")
+    app.config["MAIL_DEFAULT_SENDER"] = os.getenv(
+        "MAIL_DEFAULT_SENDER", "no-reply@collabsec.local"
+    )
     # JWT Configuration
     app.config["JWT_SECRET_KEY"] = os.getenv("JWT_SECRET_KEY", "CollabSecJWTSecret")
+    app.config["JWT_TOKEN_LOCATION"] = ["headers", "cookies"]
+    app.config["JWT_COOKIE_CSRF_PROTECT"] = True
     app.config["JWT_COOKIE_DOMAIN"] = os.getenv("JWT_COOKIE_DOMAIN", None)
     app.config["JWT_COOKIE_PATH"] = os.getenv("JWT_COOKIE_PATH", "/")
     app.config["JWT_COOKIE_SECURE"] = os.getenv("JWT_COOKIE_SECURE", True)
+    # Cache Configuration (Redis is shared across workers; memory is per-process)
+    app.config["REDIS_URL"] = os.getenv("REDIS_URL", None)
+    app.config["CACHE_EXPIRATION"] = int(os.getenv("CACHE_EXPIRATION", 300))
+    # Role/status snapshots behind every authorization check; kept well below token lifetime
+    app.config["IDENTITY_CACHE_TTL"] = int(os.getenv("IDENTITY_CACHE_TTL", 60))
+    # Per-user project access decisions, also dropped when assignments change
+    app.config["ACCESS_CACHE_TTL"] = int(os.getenv("ACCESS_CACHE_TTL", 30))
+    # EC2 instance states change often; keep them only briefly
+    app.config["EC2_STATUS_TTL"] = int(os.getenv("EC2_STATUS_TTL", 10))
+    # Rate limits share Redis when available so they hold across workers
+    app.config["RATELIMIT_STORAGE_URI"] = app.config["REDIS_URL"] or "memory://"
+    app.config["AI_USER_RATE_LIMIT"] = os.getenv("AI_USER_RATE_LIMIT", "10/minute")
+    app.config["AI_IP_RATE_LIMIT"] = os.getenv("AI_IP_RATE_LIMIT", "30/minute")
+    # Answers to repeated AI questions are reused for this many seconds
+    app.config["AI_ANSWER_TTL"] = int(os.getenv("AI_ANSWER_TTL", 3600))
+    # Password hashing cost: 10 rounds is ~4x cheaper per login than the default 12
+    app.config["BCRYPT_LOG_ROUNDS"] = int(os.getenv("BCRYPT_LOG_ROUNDS", 10))
+    # Serve /apidocs and /apispec.json; deployments can turn them off
+    app.config["ENABLE_SWAGGER"] = os.getenv("ENABLE_SWAGGER", "true").lower() == "true"
 
 
     db.init_app(app)
+    if app.config["REDIS_URL"]:
+        cache_region.configure(
+            "dogpile.cache.redis",
+            expiration_time=app.config["CACHE_EXPIRATION"],
+            arguments={"url": app.config["REDIS_URL"], "distributed_lock": True},
+            replace_existing_backend=True,
+        )
+    else:
+        cache_region.configure(
+            "dogpile.cache.memory",
+            expiration_time=app.config["CACHE_EXPIRATION"],
+            replace_existing_backend=True,
+        )
     migrate.init_app(app, db)
+    limiter.init_app(app)
     jwt.init_app(app)
-    Swagger(
-        app,
-        config={
-            "headers": [],
-            "specs": [
-                {
-                    "endpoint": "apispec",
-                    "route": "/apispec.json",
-                    "rule_filter": lambda rule: True,  # include all endpoints
-                    "model_filter": lambda tag: True,  # include all models
-                }
-            ],
-            "static_url_path": "/flasgger_static",
-            "swagger_ui": True,
-            "specs_route": "/apidocs/",
-            "securityDefinitions": {
-                "BearerAuth": {
-                    "type": "apiKey",
-                    "name": "Authorization",
-                    "in": "header",
-                    "description": "Enter JWT token like: **Bearer &lt;your_token&gt;**",
-                }
+    swagger = None
+    if app.config["ENABLE_SWAGGER"]:
+        swagger = Swagger(
+            app,
+            config={
+                "headers": [],
+                "specs": [
+                    {
+                        "endpoint": "apispec",
+                        "route": "/apispec.json",
+                        "rule_filter": lambda rule: True,  # include all endpoints
+                        "model_filter": lambda tag: True,  # include all models
+                    }
+                ],
+                "static_url_path": "/flasgger_static",
+                "swagger_ui": True,
+                "specs_route": "/apidocs/",
+                "securityDefinitions": {
+                    "BearerAuth": {
+                        "type": "apiKey",
+                        "name": "Authorization",
+                        "in": "header",
+                        "description": "Enter JWT token like: **Bearer &lt;your_token&gt;**",
+                    }
+                },
+                "security": [{"BearerAuth": []}],
             },
-            "security": [{"BearerAuth": []}],
-        },
-    )
+        )
 
     uploads_dir = os.path.join(app.config["UPLOADS_DIR"])
     os.makedirs(uploads_dir, exist_ok=True)
@@ -105,11 +219,31 @@ def create_app():
     app.register_blueprint(admin_user_bp, url_prefix="/admin/user")
     app.register_blueprint(admin_vm_bp, url_prefix="/admin/vm")
     app.register_blueprint(admin_project_bp, url_prefix="/admin/project")
+
+    # Build the API spec now, before workers fork, instead of on the first
+    # /apispec.json hit; outside debug mode flasgger keeps reusing this copy
+    if swagger:
+        with app.test_request_context():
+            swagger.get_apispecs("apispec")
     # Initialize SocketIO
 
     from app.socket import socketio
 
-    socketio.init_app(app, cors_allowed_origins="*")  # In production, restrict origins
+    # engineio only treats a bare "*" string as the wildcard, not ["*"]
+    socketio.init_app(
+        app,
+        cors_allowed_origins="*" if "*" in cors_origins else cors_origins,
+        json=SocketIOJSON,
+    )
+
+    # Run from cron/systemd timer, e.g. every 5 minutes: flask purge-password-resets
+    @app.cli.command("purge-password-resets")
+    def purge_password_resets():
+        """Delete expired password reset tokens."""
+        from app.models import PasswordReset
+
+        print(f"Deleted {PasswordReset.purge_expired()} expired reset token(s)")
+
     return app
 
 
@@ -124,5 +258,6 @@ if __name__ == "__main__":
         app,
         host=os.getenv("FLASK_HOST", "127.0.0.1"),
         port=int(os.getenv("FLASK_PORT", 5000)),
-        debug=os.getenv("FLASK_DEBUG", True),
+        # Off unless asked for; any non-empty string used to count as on
+        debug=os.getenv("FLASK_DEBUG", "false").lower() in ("1", "true"),
     )